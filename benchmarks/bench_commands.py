@@ -0,0 +1,407 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Benchmark of shell commands against a synthetic orchestrator-core database.
+
+For every number of subscriptions, the orchestrator-core subscription tables are created and filled with synthetic
+subscriptions, after which subscription list, search, select and details, product_block list, resource_type update,
+audit and count are run through OrchestratorShell.onecmd. The latency of every command and its peak memory allocation
+are written to a JSON report that can be compared with the report of another commit. By default a SQLite file is used
+as stand-in for PostgreSQL, use --database-url to benchmark against a scratch PostgreSQL database instead, note that
+its orchestrator-core tables are dropped. Run with:
+
+    python benchmarks/bench_commands.py --sizes 1000,10000 --output report.json [--compare previous.json]
+"""
+
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+from collections.abc import Iterator
+from datetime import UTC, datetime
+from pathlib import Path
+from statistics import median
+from tempfile import gettempdir
+from time import perf_counter
+from typing import Any
+from uuid import UUID, uuid4
+
+import sqlalchemy
+from orchestrator.db import (
+    ProductBlockTable,
+    ProductTable,
+    ResourceTypeTable,
+    SubscriptionCustomerDescriptionTable,
+    SubscriptionInstanceRelationTable,
+    SubscriptionInstanceTable,
+    SubscriptionInstanceValueTable,
+    SubscriptionTable,
+    db,
+)
+from orchestrator.db.database import BaseModel
+from orchestrator.db.models import (
+    ProductBlockRelationTable,
+    product_block_resource_type_association,
+    product_product_block_association,
+)
+from sqlalchemy import ColumnDefault, DefaultClause, Table, insert, text
+from tabulate import tabulate
+
+from orchestrator_shell.database import init_database
+from orchestrator_shell.main import OrchestratorShell
+from orchestrator_shell.state import state
+
+TABLES: list[Table] = [
+    ProductTable.__table__,
+    ProductBlockTable.__table__,
+    ResourceTypeTable.__table__,
+    SubscriptionTable.__table__,
+    SubscriptionInstanceTable.__table__,
+    SubscriptionInstanceValueTable.__table__,
+    SubscriptionInstanceRelationTable.__table__,
+    SubscriptionCustomerDescriptionTable.__table__,
+    ProductBlockRelationTable.__table__,
+    product_block_resource_type_association,
+    product_product_block_association,
+]
+
+# number of rows per insert statement while generating the database
+INSERT_CHUNK_SIZE = 10_000
+
+
+def argument_parser() -> ArgumentParser:
+    """Return parser for the benchmark options."""
+    parser = ArgumentParser(description="Benchmark shell commands against a synthetic orchestrator-core database.")
+    parser.add_argument(
+        "--database-url",
+        default=f"sqlite:///{Path(gettempdir()) / 'orchestrator_shell_bench.sqlite3'}",
+        help="scratch database, its orchestrator-core tables are dropped (default: SQLite file in temp dir)",
+    )
+    parser.add_argument("--sizes", default="1000,10000", help="comma separated numbers of subscriptions")
+    parser.add_argument("--product-blocks", type=int, default=3, help="product blocks per subscription")
+    parser.add_argument("--resource-types", type=int, default=4, help="resource types per product block")
+    parser.add_argument("--fan-out", type=int, default=2, help="depends on relations per product block")
+    parser.add_argument("--repeat", type=int, default=5, help="number of times every command is run")
+    parser.add_argument(
+        "--set", action="append", default=[], metavar="NAME=VALUE", help="shell setting, like page_size=100"
+    )
+    parser.add_argument("--output", type=Path, help="write JSON report to this file")
+    parser.add_argument("--compare", type=Path, help="compare with JSON report of an earlier run")
+    return parser
+
+
+def connect(database_url: str) -> None:
+    """Point orchestrator-core at the database as the shell does, on SQLite without the PostgreSQL specifics."""
+    database = init_database(database_url)
+    if database.engine.dialect.name == "sqlite":
+        for table in TABLES:
+            for column in table.columns:
+                default = str(column.server_default.arg) if isinstance(column.server_default, DefaultClause) else ""
+                if "uuid_generate_v4" in default:
+                    # also used by the shell when it inserts values of unset resource types
+                    column.server_default = None
+                    column.default = ColumnDefault(uuid4)
+                elif "timestamp" in default:
+                    column.server_default = DefaultClause(text("CURRENT_TIMESTAMP"))
+    else:
+        with database.engine.begin() as connection:
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS "uuid-ossp"'))
+
+
+def chunked(rows: Iterator[dict[str, Any]]) -> Iterator[list[dict[str, Any]]]:
+    """Yield lists of at most INSERT_CHUNK_SIZE rows."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == INSERT_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def generate(number_of_subscriptions: int, args: Namespace) -> None:
+    """Create the tables and fill them with subscriptions that each have an instance of every product block.
+
+    The last resource type of every product block is left unset, every product block but the first depends on the
+    first product block of its subscription, and the first product block depends on the first product block of the
+    preceding subscriptions up to the fan out.
+    """
+    BaseModel.metadata.drop_all(db.engine, tables=TABLES)
+    BaseModel.metadata.create_all(db.engine, tables=TABLES)
+    product_id = uuid4()
+    product_block_ids = [uuid4() for _ in range(args.product_blocks)]
+    resource_type_ids = [[uuid4() for _ in range(args.resource_types)] for _ in product_block_ids]
+    subscription_ids = [uuid4() for _ in range(number_of_subscriptions)]
+    instance_ids = [[uuid4() for _ in product_block_ids] for _ in subscription_ids]
+    with db.engine.begin() as connection:
+        connection.execute(
+            insert(ProductTable.__table__),
+            {
+                "product_id": product_id,
+                "name": "bench",
+                "description": "bench",
+                "product_type": "Bench",
+                "tag": "BENCH",
+                "status": "active",
+            },
+        )
+        for block, product_block_id in enumerate(product_block_ids):
+            connection.execute(
+                insert(ProductBlockTable.__table__),
+                {"product_block_id": product_block_id, "name": f"block{block}", "description": "bench"},
+            )
+            connection.execute(
+                insert(product_product_block_association),
+                {"product_id": product_id, "product_block_id": product_block_id},
+            )
+            for resource_type, resource_type_id in enumerate(resource_type_ids[block]):
+                connection.execute(
+                    insert(ResourceTypeTable.__table__),
+                    {"resource_type_id": resource_type_id, "resource_type": f"block{block}_rt{resource_type}"},
+                )
+                connection.execute(
+                    insert(product_block_resource_type_association),
+                    {"product_block_id": product_block_id, "resource_type_id": resource_type_id},
+                )
+        tables_and_rows: list[tuple[Table, Iterator[dict[str, Any]]]] = [
+            (SubscriptionTable.__table__, subscription_rows(subscription_ids, product_id)),
+            (SubscriptionInstanceTable.__table__, instance_rows(subscription_ids, instance_ids, product_block_ids)),
+            (SubscriptionInstanceValueTable.__table__, value_rows(instance_ids, resource_type_ids)),
+            (SubscriptionInstanceRelationTable.__table__, relation_rows(instance_ids, args.fan_out)),
+        ]
+        for table, rows in tables_and_rows:
+            for chunk in chunked(rows):
+                connection.execute(insert(table), chunk)
+
+
+def subscription_rows(subscription_ids: list[UUID], product_id: UUID) -> Iterator[dict[str, Any]]:
+    """Yield subscriptions, one in a hundred has a description that ends on customer 7."""
+    for index, subscription_id in enumerate(subscription_ids):
+        yield {
+            "subscription_id": subscription_id,
+            "description": f"subscription {index:07d} customer {index % 100}",
+            "status": "active",
+            "product_id": product_id,
+            "customer_id": f"customer {index % 100}",
+            "insync": True,
+            "version": 1,
+        }
+
+
+def instance_rows(
+    subscription_ids: list[UUID], instance_ids: list[list[UUID]], product_block_ids: list[UUID]
+) -> Iterator[dict[str, Any]]:
+    """Yield a product block instance of every product block for every subscription."""
+    for subscription_id, instances in zip(subscription_ids, instance_ids, strict=True):
+        for instance_id, product_block_id in zip(instances, product_block_ids, strict=True):
+            yield {
+                "subscription_instance_id": instance_id,
+                "subscription_id": subscription_id,
+                "product_block_id": product_block_id,
+            }
+
+
+def value_rows(instance_ids: list[list[UUID]], resource_type_ids: list[list[UUID]]) -> Iterator[dict[str, Any]]:
+    """Yield a value for all but the last resource type of every product block instance."""
+    for index, instances in enumerate(instance_ids):
+        for instance_id, resource_types in zip(instances, resource_type_ids, strict=True):
+            for resource_type, resource_type_id in enumerate(resource_types[:-1]):
+                yield {
+                    "subscription_instance_value_id": uuid4(),
+                    "subscription_instance_id": instance_id,
+                    "resource_type_id": resource_type_id,
+                    "value": f"value {index} {resource_type}",
+                }
+
+
+def relation_rows(instance_ids: list[list[UUID]], fan_out: int) -> Iterator[dict[str, Any]]:
+    """Yield depends on relations within and between subscriptions."""
+    for index, instances in enumerate(instance_ids):
+        for order_id, instance_id in enumerate(instances[1:]):
+            yield {
+                "in_use_by_id": instance_id,
+                "depends_on_id": instances[0],
+                "order_id": order_id,
+                "domain_model_attr": "root",
+            }
+        for order_id, preceding in enumerate(range(max(index - fan_out, 0), index)):
+            yield {
+                "in_use_by_id": instances[0],
+                "depends_on_id": instance_ids[preceding][0],
+                "order_id": order_id,
+                "domain_model_attr": "preceding",
+            }
+
+
+def commands(number_of_subscriptions: int, run: int) -> list[tuple[str | None, str]]:
+    """Return benchmark names and shell commands of a run, every run selects another subscription.
+
+    Commands without a name only prepare the next command and are not measured.
+    """
+    index = (run * 7919) % number_of_subscriptions
+    return [
+        ("subscription list", "subscription list"),
+        ("subscription search", "subscription search 'customer 7$'"),
+        (None, f"subscription search '^subscription {index:07d} '"),
+        ("subscription select", "subscription select 0"),
+        ("subscription details", "subscription details"),
+        ("product_block list", "product_block list"),
+        ("product_block select", "product_block select 0"),
+        ("resource_type select", "resource_type select 0"),
+        ("resource_type update", f"resource_type update 'bench {run}'"),
+        ("audit", "audit"),
+        ("count", "count --by status product customer"),
+    ]
+
+
+def run_command(shell: OrchestratorShell, command: str) -> float:
+    """Run command in the shell and return its latency in seconds, exit when the command fails."""
+    shell.command_failed = False
+    start_time = perf_counter()
+    shell.onecmd(command)
+    seconds = perf_counter() - start_time
+    if shell.command_failed:
+        sys.exit(f"benchmark command failed: {command}")
+    return seconds
+
+
+def new_shell(settings: list[str]) -> OrchestratorShell:
+    """Return shell with empty state and settings applied, that writes its output to the null device."""
+    # the state is shared between the command modules, reset it in place
+    state.__init__()  # type: ignore[misc]
+    db.session.close()
+    shell = OrchestratorShell(batch=True)
+    shell.stdout = open(os.devnull, "w")  # noqa: PTH123
+    shell.database_initialised = True
+    for setting in settings:
+        name, _, value = setting.partition("=")
+        run_command(shell, f"set {name} {value}")
+    return shell
+
+
+def benchmark(number_of_subscriptions: int, args: Namespace) -> dict[str, Any]:
+    """Return latency and memory of the benchmark commands on a new synthetic database of this size."""
+    start_time = perf_counter()
+    generate(number_of_subscriptions, args)
+    generate_seconds = perf_counter() - start_time
+    latencies: dict[str, list[float]] = {}
+    shell = new_shell(args.set)
+    for run in range(args.repeat):
+        for name, command in commands(number_of_subscriptions, run):
+            seconds = run_command(shell, command)
+            if name is not None:
+                latencies.setdefault(name, []).append(seconds)
+    # peak memory is measured in a separate run, tracemalloc slows down every allocation
+    peaks: dict[str, int] = {}
+    shell = new_shell(args.set)
+    tracemalloc.start()
+    for name, command in commands(number_of_subscriptions, args.repeat):
+        tracemalloc.reset_peak()
+        allocated = tracemalloc.get_traced_memory()[0]
+        run_command(shell, command)
+        if name is not None:
+            peaks[name] = tracemalloc.get_traced_memory()[1] - allocated
+    tracemalloc.stop()
+    return {
+        "subscriptions": number_of_subscriptions,
+        "generate seconds": round(generate_seconds, 3),
+        "max rss kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "commands": {
+            name: {
+                "median ms": round(median(seconds) * 1000, 3),
+                "min ms": round(min(seconds) * 1000, 3),
+                "max ms": round(max(seconds) * 1000, 3),
+                "peak kib": peaks[name] // 1024,
+            }
+            for name, seconds in latencies.items()
+        },
+    }
+
+
+def git_commit() -> str | None:
+    """Return commit of the working tree, or None outside a git repository."""
+    result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=False)  # noqa: S607
+    return result.stdout.strip() or None
+
+
+def result_table(result: dict[str, Any]) -> str:
+    """Return table with the measurements of every command."""
+    headers = ["command", "median ms", "min ms", "max ms", "peak kib"]
+    return tabulate(
+        [
+            (name, *(measurements[header] for header in headers[1:]))
+            for name, measurements in result["commands"].items()
+        ],
+        headers=headers,
+    )
+
+
+def comparison(report: dict[str, Any], previous: dict[str, Any]) -> str:
+    """Return table with the median latency and peak memory of both reports and their ratio."""
+    previous_results = {result["subscriptions"]: result["commands"] for result in previous["results"]}
+    rows = []
+    for result in report["results"]:
+        for name, measurements in result["commands"].items():
+            if (before := previous_results.get(result["subscriptions"], {}).get(name)) is None:
+                continue
+            rows.append(
+                (
+                    result["subscriptions"],
+                    name,
+                    before["median ms"],
+                    measurements["median ms"],
+                    measurements["median ms"] / before["median ms"] if before["median ms"] else None,
+                    before["peak kib"],
+                    measurements["peak kib"],
+                )
+            )
+    headers = ["subscriptions", "command", "before ms", "after ms", "ratio", "before kib", "after kib"]
+    return tabulate(rows, headers=headers, floatfmt=".3f")
+
+
+def main() -> None:
+    """Run the benchmark for every size, show the results and write the JSON report."""
+    args = argument_parser().parse_args()
+    connect(args.database_url)
+    report: dict[str, Any] = {
+        "commit": git_commit(),
+        "date": datetime.now(UTC).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "database": db.engine.dialect.name,
+        "parameters": {
+            "product blocks": args.product_blocks,
+            "resource types": args.resource_types,
+            "fan out": args.fan_out,
+            "repeat": args.repeat,
+            "settings": args.set,
+        },
+        "results": [],
+    }
+    for size in (int(size) for size in args.sizes.split(",")):
+        result = benchmark(size, args)
+        report["results"].append(result)
+        print(f"{size} subscriptions, generated in {result['generate seconds']} s")
+        print(result_table(result))
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.compare is not None:
+        print(comparison(report, json.loads(args.compare.read_text())))
+
+
+if __name__ == "__main__":
+    main()
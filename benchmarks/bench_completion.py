@@ -0,0 +1,64 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Latency benchmark of completing subscription descriptions.
+
+Generates a synthetic database like the command benchmark, by default a SQLite file, builds the index of subscription
+descriptions once, like the first completion in the shell does, and measures the latency of completing typed text
+against that index. Run with:
+
+    python benchmarks/bench_completion.py [number of subscriptions]
+"""
+
+import sys
+from argparse import Namespace
+from pathlib import Path
+from statistics import median
+from tempfile import gettempdir
+from time import perf_counter
+
+from bench_commands import connect, generate
+
+from orchestrator_shell.subscripition import subscription_names
+
+# typed text with prefix matches, fragment matches, and no matches at all
+TYPED = [
+    "",
+    "subscription 00",
+    "subscription 0012345 customer 45",
+    "customer 7",
+    "0004 customer 9",
+    "customer 99 subscription 00099",
+    "no such subscription",
+]
+REPEAT = 5
+
+
+def main() -> None:
+    """Show time to build the index and median completion latency per typed text."""
+    number_of_subscriptions = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    connect(f"sqlite:///{Path(gettempdir()) / 'orchestrator_shell_bench.sqlite3'}")
+    generate(number_of_subscriptions, Namespace(product_blocks=1, resource_types=1, fan_out=0))
+    start_time = perf_counter()
+    names = subscription_names()
+    print(f"{'query and index ' + str(len(names)):<40}{(perf_counter() - start_time) * 1000:>10.1f} ms")
+    for text in TYPED:
+        latencies = []
+        for _ in range(REPEAT):
+            start_time = perf_counter()
+            completions = names.complete(text)
+            latencies.append(perf_counter() - start_time)
+        print(f"{text!r:<40}{median(latencies) * 1000:>10.1f} ms{len(completions):>6} completions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Memory benchmark of a subscription listing held as ORM objects, as SQLAlchemy rows, and as listed subscriptions.
+
+Generates a synthetic database like the command benchmark, by default a SQLite file, and measures the memory that
+stays allocated while the listing is held, as the shell holds it in its state. Run with:
+
+    python benchmarks/bench_listing_memory.py [number of subscriptions]
+"""
+
+import gc
+import sys
+import tracemalloc
+from argparse import Namespace
+from collections.abc import Callable, Sequence
+from pathlib import Path
+from tempfile import gettempdir
+from typing import Any
+
+from bench_commands import connect, generate
+from orchestrator.db import SubscriptionTable, db
+
+from orchestrator_shell.subscripition import listed_subscriptions, query_db_filtered
+
+
+def retained(listing: Callable[[], Sequence[Any]]) -> int:
+    """Return number of bytes that stay allocated while the listing is held, with an empty session to start with."""
+    db.session.close()
+    gc.collect()
+    tracemalloc.start()
+    subscriptions = listing()
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del subscriptions
+    return allocated
+
+
+def main() -> None:
+    """Show memory held per listing for each representation."""
+    number_of_subscriptions = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    connect(f"sqlite:///{Path(gettempdir()) / 'orchestrator_shell_bench.sqlite3'}")
+    generate(number_of_subscriptions, Namespace(product_blocks=1, resource_types=1, fan_out=0))
+    listings: dict[str, Callable[[], Sequence[Any]]] = {
+        "ORM objects": lambda: SubscriptionTable.query.all(),
+        "SQLAlchemy rows": lambda: db.session.execute(listed_subscriptions(None)).all(),
+        "listed subscriptions": lambda: query_db_filtered(None),
+    }
+    for name, listing in listings.items():
+        allocated = retained(listing)
+        print(
+            f"{name:<30}{allocated / 2**20:>10.1f} MiB{allocated / number_of_subscriptions:>10.0f} bytes/subscription"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Microbenchmark of product_block_table against the original nested tabulate implementation.
+
+Builds transient product blocks in memory, no database is needed. Run with:
+
+    python benchmarks/bench_product_block_table.py
+"""
+
+from functools import partial
+from random import Random
+from timeit import timeit
+from uuid import uuid4
+
+from orchestrator.db import (
+    ProductBlockTable,
+    ResourceTypeTable,
+    SubscriptionInstanceTable,
+    SubscriptionInstanceValueTable,
+)
+from tabulate import tabulate
+
+from orchestrator_shell.product_block import product_block_table
+from orchestrator_shell.resource_type import resource_type_table
+from orchestrator_shell.state import all_resource_types
+
+
+def original_product_block_table(product_blocks: list[SubscriptionInstanceTable]) -> str:
+    """Return indexed table of product blocks, as implemented before the single pass renderer."""
+    max_rt_width = max([len(rt.resource_type.resource_type) for pb in product_blocks for rt in all_resource_types(pb)])
+    return tabulate(
+        [
+            [
+                tabulate(
+                    [
+                        ["name", product_block.product_block.name],
+                        ["resource types", resource_type_table(all_resource_types(product_block), max_rt_width)],
+                    ],
+                    tablefmt="plain",
+                )
+            ]
+            for product_block in product_blocks
+        ],
+        tablefmt="plain",
+        disable_numparse=True,
+        showindex=True,
+    )
+
+
+def generate_product_blocks(
+    random: Random, number_of_product_blocks: int, values: list[str]
+) -> list[SubscriptionInstanceTable]:
+    """Return transient product blocks with a random selection of set and unset resource types."""
+    resource_types = [
+        ResourceTypeTable(resource_type_id=uuid4(), resource_type=f"resource_type_{'x' * random.randrange(8)}{i}")
+        for i in range(30)
+    ]
+    product_blocks = []
+    for i in range(number_of_product_blocks):
+        block_resource_types = random.sample(resource_types, random.randrange(len(resource_types)))
+        product_blocks.append(
+            SubscriptionInstanceTable(
+                subscription_instance_id=uuid4(),
+                product_block=ProductBlockTable(name=f"Block{i}", resource_types=block_resource_types),
+                values=[
+                    SubscriptionInstanceValueTable(resource_type=rt, value=random.choice(values))
+                    for rt in block_resource_types
+                    if random.random() < 0.8
+                ],
+            )
+        )
+    return product_blocks
+
+
+def main() -> None:
+    """Check that both implementations render identical tables and show their timings."""
+    random = Random(0)  # noqa: S311
+    plain_values = ["", "1", "42", "ethernet-1/1", " leading space", "trailing space ", "True", "10.0.0.0/24"]
+    other_values = ["multi\nline", "tab\tseparated", "wide 日本", "café"]
+    for values in (plain_values, plain_values + other_values):
+        for number_of_product_blocks in (1, 9, 11, 100):
+            product_blocks = generate_product_blocks(random, number_of_product_blocks, values)
+            assert product_block_table(product_blocks) == original_product_block_table(product_blocks)  # noqa: S101
+
+    product_blocks = generate_product_blocks(random, 500, plain_values)
+    print(f"{'implementation':<30}{'seconds per table':>20}")
+    for name, implementation in (
+        ("original nested tabulate", original_product_block_table),
+        ("single pass", product_block_table),
+    ):
+        seconds = timeit(partial(implementation, product_blocks), number=5) / 5
+        print(f"{name:<30}{seconds:>20.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Startup benchmark that guards the time it takes before the shell can show its first prompt.
+
+Starts fresh interpreters that create the shell without running it, no database is needed. Exits with a non-zero
+status when orchestrator-core is imported before the first command, or when the median startup time exceeds the
+budget. Run with:
+
+    python benchmarks/bench_startup.py [budget in seconds]
+"""
+
+import subprocess
+import sys
+from statistics import median
+from time import perf_counter
+
+STATEMENT = """
+import sys
+from orchestrator_shell import OrchestratorShell
+OrchestratorShell()
+print(sorted(module for module in sys.modules if module.split(".")[0] in ("orchestrator", "sqlalchemy")))
+"""
+
+
+def start_shell() -> tuple[float, str]:
+    """Return seconds needed to import and create the shell in a fresh interpreter, and the heavy modules loaded."""
+    start_time = perf_counter()
+    result = subprocess.run([sys.executable, "-c", STATEMENT], capture_output=True, text=True, check=True)  # noqa: S603
+    return perf_counter() - start_time, result.stdout.strip()
+
+
+def main() -> None:
+    """Show the median startup time and check it against the budget."""
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    timings = []
+    for _ in range(5):
+        seconds, heavy_modules = start_shell()
+        timings.append(seconds)
+        if heavy_modules != "[]":
+            sys.exit(f"modules imported before the first command: {heavy_modules}")
+    print(f"{'median startup':<30}{median(timings):>10.3f} s")
+    print(f"{'budget':<30}{budget:>10.3f} s")
+    if median(timings) > budget:
+        sys.exit("startup exceeds budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,9 +14,23 @@
 
 __version__ = "0.2.0"
 
+import sys
+
+import orchestrator_shell.startup  # noqa: F401 first import, so startup is timed from here
+from orchestrator_shell.batch import batch_argument_parser, batch_commands, is_batch
 from orchestrator_shell.main import OrchestratorShell
+from orchestrator_shell.settings import settings
 
 
-def main():
-    shell = OrchestratorShell()
-    shell.cmdloop()
+def main() -> None:
+    """Run the shell interactively, or run commands in batch mode when given as option, in a file or on stdin."""
+    args, cli_args = batch_argument_parser().parse_known_args()
+    if args.format is not None:
+        settings.ORCHESTRATOR_SHELL_FORMAT = args.format
+    if not is_batch(args, sys.stdin):
+        # leave the remaining arguments to be run as commands by the interactive shell
+        sys.argv[1:] = cli_args
+        sys.exit(OrchestratorShell().cmdloop())
+    shell = OrchestratorShell(batch=True)
+    commands = batch_commands(args, cli_args, sys.stdin)
+    sys.exit(shell.run_batch(commands, keep_going=args.keep_going, status=args.status))
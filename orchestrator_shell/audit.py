@@ -0,0 +1,187 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import Counter
+from collections.abc import Callable, Generator
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from time import perf_counter
+from uuid import UUID
+
+from orchestrator.db import (
+    ProductBlockTable,
+    ResourceTypeTable,
+    SubscriptionInstanceRelationTable,
+    SubscriptionInstanceTable,
+    SubscriptionInstanceValueTable,
+    SubscriptionTable,
+    db,
+)
+from orchestrator.types import SubscriptionLifecycle
+from sqlalchemy import ColumnElement, CompoundSelect, Row, Select, and_, func, literal, select, union_all
+from sqlalchemy.orm import aliased
+
+from orchestrator_shell.database import pool_capacity
+from orchestrator_shell.output import Record, is_table_format, render_table
+from orchestrator_shell.state import description_matches, validate_regular_expression
+
+# the subscription id range is split in this many chunks, that are audited concurrently
+AUDIT_CHUNKS = 16
+AUDIT_WORKERS = 4
+
+
+def status_rules() -> dict[str, ColumnElement[bool]]:
+    """Return the conditions on subscription fields that are inconsistent with each other, by name."""
+    status, insync = SubscriptionTable.status, SubscriptionTable.insync
+    terminated = SubscriptionLifecycle.TERMINATED.value
+    return {
+        "active without start date": and_(
+            status == SubscriptionLifecycle.ACTIVE.value, SubscriptionTable.start_date.is_(None)
+        ),
+        "terminated without end date": and_(status == terminated, SubscriptionTable.end_date.is_(None)),
+        "end date while not terminated": and_(status != terminated, SubscriptionTable.end_date.is_not(None)),
+        "not in sync": and_(status != SubscriptionLifecycle.INITIAL.value, insync.is_(False)),
+        "in sync while initial": and_(status == SubscriptionLifecycle.INITIAL.value, insync.is_(True)),
+    }
+
+
+def unset_resource_types(where: list[ColumnElement[bool]]) -> Select:
+    """Return query for the resource types of product blocks that have no value, as shown by 'product_block details'.
+
+    The database does not know which resource types are required, so optional and non-scalar ones are found as well.
+    """
+    return (
+        select(
+            (ProductBlockTable.name + "." + ResourceTypeTable.resource_type).label("finding"),
+            SubscriptionInstanceTable.subscription_id,
+        )
+        .join(SubscriptionInstanceTable.subscription)
+        .join(SubscriptionInstanceTable.product_block)
+        .join(ProductBlockTable.resource_types)
+        .outerjoin(
+            SubscriptionInstanceValueTable,
+            and_(
+                SubscriptionInstanceValueTable.subscription_instance_id
+                == SubscriptionInstanceTable.subscription_instance_id,
+                SubscriptionInstanceValueTable.resource_type_id == ResourceTypeTable.resource_type_id,
+            ),
+        )
+        .where(SubscriptionInstanceValueTable.subscription_instance_value_id.is_(None), *where)
+    )
+
+
+def terminated_dependencies(where: list[ColumnElement[bool]]) -> Select:
+    """Return query for product blocks of subscriptions in use that depend on a product block of a terminated one."""
+    depends_on = aliased(SubscriptionInstanceTable)
+    depends_on_subscription = aliased(SubscriptionTable)
+    depends_on_product_block = aliased(ProductBlockTable)
+    terminated = SubscriptionLifecycle.TERMINATED.value
+    return (
+        select(
+            (ProductBlockTable.name + " depends on terminated " + depends_on_product_block.name).label("finding"),
+            SubscriptionInstanceTable.subscription_id,
+        )
+        .select_from(SubscriptionInstanceRelationTable)
+        .join(
+            SubscriptionInstanceTable,
+            SubscriptionInstanceTable.subscription_instance_id == SubscriptionInstanceRelationTable.in_use_by_id,
+        )
+        .join(SubscriptionInstanceTable.subscription)
+        .join(SubscriptionInstanceTable.product_block)
+        .join(depends_on, depends_on.subscription_instance_id == SubscriptionInstanceRelationTable.depends_on_id)
+        .join(depends_on_subscription, depends_on.subscription)
+        .join(depends_on_product_block, depends_on.product_block)
+        .where(SubscriptionTable.status != terminated, depends_on_subscription.status == terminated, *where)
+    )
+
+
+def inconsistent_status(where: list[ColumnElement[bool]]) -> CompoundSelect:
+    """Return query for subscriptions with status, insync, start date and end date that contradict each other."""
+    return union_all(
+        *(
+            select(literal(name).label("finding"), SubscriptionTable.subscription_id).where(rule, *where)
+            for name, rule in status_rules().items()
+        )
+    )
+
+
+AUDIT_CHECKS: dict[str, Callable[[list[ColumnElement[bool]]], Select | CompoundSelect]] = {
+    "unset": unset_resource_types,
+    "relations": terminated_dependencies,
+    "status": inconsistent_status,
+}
+
+
+def id_ranges(chunks: int) -> list[tuple[UUID | None, UUID | None]]:
+    """Return chunks ranges of subscription ids of about equal size, as random UUIDs are evenly distributed."""
+    bounds = [UUID(int=chunk * 2**128 // chunks) for chunk in range(1, chunks)]
+    return list(zip([None, *bounds], [*bounds, None], strict=True))
+
+
+def findings_query(check: str, where: list[ColumnElement[bool]]) -> Select:
+    """Return query for the number of subscriptions per finding of check."""
+    findings = AUDIT_CHECKS[check](where).subquery()
+    return select(findings.c.finding, func.count(findings.c.subscription_id.distinct())).group_by(findings.c.finding)
+
+
+def count_findings(query: Select) -> list[Row]:
+    """Return the number of subscriptions per finding, queried on a connection of its own."""
+    with db.engine.connect() as connection:
+        return list(connection.execute(query).all())
+
+
+def audit_filter(regular_expression: str | None, low: UUID | None, high: UUID | None) -> list[ColumnElement[bool]]:
+    """Return conditions on the audited subscriptions, optionally matching regular expression, within an id range."""
+    where = [] if regular_expression is None else [description_matches(regular_expression)]
+    if low is not None:
+        where.append(SubscriptionTable.subscription_id >= low)
+    if high is not None:
+        where.append(SubscriptionTable.subscription_id < high)
+    return where
+
+
+def audit(checks: list[str], regular_expression: str | None, chunks: int, workers: int) -> Generator[str, None, None]:
+    """Implementation of the 'audit' command, yielding progress after every check and the findings at the end.
+
+    Every check is a grouped count in the database per chunk of the subscription id range. The chunks are counted
+    concurrently on connections of their own, so the database can use several cores, and their counts are added up.
+    """
+    if regular_expression is not None:
+        validate_regular_expression(regular_expression)
+    start_time = perf_counter()
+    counts: dict[str, Counter[str]] = {check: Counter() for check in checks}
+    remaining = dict.fromkeys(checks, chunks)
+    # more workers than the pool has connections would wait for a connection, and fail when that takes too long,
+    # one connection is left for the session of the shell
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, pool_capacity() - 1)), thread_name_prefix="audit")
+    try:
+        futures: dict[Future[list[Row]], str] = {
+            executor.submit(count_findings, findings_query(check, audit_filter(regular_expression, low, high))): check
+            for check in checks
+            for low, high in id_ranges(chunks)
+        }
+        for future in as_completed(futures):
+            check = futures[future]
+            for finding, number in future.result():
+                counts[check][finding] += number
+            remaining[check] -= 1
+            if not remaining[check]:
+                yield f"{check}: {len(counts[check])} findings in {perf_counter() - start_time:.2f} seconds"
+    finally:
+        # an interrupted audit does not start the chunks that are still waiting
+        executor.shutdown(wait=False, cancel_futures=True)
+    records: list[Record] = [
+        {"check": check, "finding": finding, "subscriptions": number}
+        for check in checks
+        for finding, number in sorted(counts[check].items())
+    ]
+    yield render_table(records) if records or not is_table_format() else "no findings"
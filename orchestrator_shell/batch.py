@@ -0,0 +1,79 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import sys
+from argparse import ArgumentParser, FileType, Namespace
+from collections.abc import Iterable, Iterator
+from typing import TextIO
+
+from orchestrator_shell.output import FORMATS
+
+# exit codes of batch mode
+EXIT_OK = 0
+EXIT_COMMAND_FAILED = 1
+EXIT_INTERRUPTED = 130
+
+
+def batch_argument_parser() -> ArgumentParser:
+    """Return parser for the command line options that select batch mode."""
+    parser = ArgumentParser(
+        prog="orchestrator-shell",
+        description="Shell for interacting with an orchestrator-core database. Without options the shell is "
+        "interactive, unless commands are piped into it, and arguments are run as commands before the first prompt, or "
+        "before the other commands in batch mode.",
+    )
+    parser.add_argument(
+        "-c",
+        "--command",
+        action="append",
+        help="run command(s), separated by newlines, in batch mode, can be given more than once",
+    )
+    parser.add_argument(
+        "-f", "--file", type=FileType("r"), help="run commands read from file, one per line, - for stdin, in batch mode"
+    )
+    parser.add_argument("--keep-going", action="store_true", help="continue with the next command after a failure")
+    parser.add_argument("--status", action="store_true", help="write a JSON status line per command to stderr")
+    parser.add_argument("--format", choices=FORMATS, help="output format of list and details commands")
+    return parser
+
+
+def is_batch(args: Namespace, stdin: TextIO) -> bool:
+    """Return True when commands are given as option, in a file, or piped into the shell."""
+    return args.command is not None or args.file is not None or not stdin.isatty()
+
+
+def batch_commands(args: Namespace, cli_args: list[str], stdin: TextIO) -> Iterator[str]:
+    """Yield the commands to run in batch mode, skipping empty lines and comments.
+
+    Arguments are run as commands first, one per argument, like the interactive shell runs them before the first prompt.
+    """
+    yield from (command for command in cli_args if command.strip())
+    if args.command is not None:
+        lines: Iterable[str] = (line for command in args.command for line in command.splitlines())
+    else:
+        lines = args.file if args.file is not None else stdin
+    for line in lines:
+        if (command := line.strip()) and not command.startswith("#"):
+            yield command
+
+
+def batch_status(command: str, failed: bool, seconds: float) -> str:
+    """Return machine-readable status of a command run in batch mode."""
+    return json.dumps({"command": command, "status": "failed" if failed else "ok", "seconds": round(seconds, 6)})
+
+
+def write_status(status: str) -> None:
+    """Write status line to stderr, apart from the command output on stdout."""
+    sys.stderr.write(f"{status}\n")
+    sys.stderr.flush()
@@ -0,0 +1,231 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import re
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from hashlib import sha256
+from pathlib import Path
+from time import time
+from uuid import UUID
+
+from orchestrator.db import ProductTable, SubscriptionTable, db
+from sqlalchemy import (
+    Column,
+    ColumnElement,
+    Engine,
+    Float,
+    Index,
+    Integer,
+    MetaData,
+    Row,
+    String,
+    Table,
+    Uuid,
+    create_engine,
+    delete,
+    func,
+    insert,
+    select,
+    update,
+)
+
+from orchestrator_shell.settings import settings
+
+metadata = MetaData()
+
+cached_subscriptions = Table(
+    "subscriptions",
+    metadata,
+    Column("subscription_id", Uuid, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("status", String, nullable=False),
+    Column("product", String, nullable=False),
+    Column("customer_id", String, nullable=False),
+    # version of the subscription in the database, -1 forces a refetch on the next refresh
+    Column("version", Integer, nullable=False),
+    Index("cached_subscriptions_description_ix", "description", "subscription_id"),
+)
+
+sync = Table(
+    "sync",
+    metadata,
+    Column("database", String, primary_key=True),
+    Column("synced_at", Float, nullable=False),
+)
+
+
+def database_key() -> str:
+    """Return key that identifies the database the cache is a snapshot of, without revealing its credentials."""
+    return sha256(str(settings.DATABASE_URI).encode()).hexdigest()
+
+
+@dataclass
+class SubscriptionCache:
+    """Local snapshot of the subscription catalogue in a SQLite file, that is incrementally refreshed.
+
+    The subscriptions table has no modification timestamp, and its version is per subscription, so there is no high
+    water mark to fetch only the changes since the last refresh. Instead, a refresh scans the ids and versions of all
+    subscriptions in the database and compares them with the cache, and only fetches the complete rows of the
+    subscriptions that were added or changed. On PostgreSQL a trigger of orchestrator-core increments the version on
+    every update, also on the updates of this shell. Subscriptions changed by this shell are invalidated only so that
+    the next listing refreshes the cache without waiting for its time to live.
+    """
+
+    path: Path
+    engine: Engine | None = field(default=None, repr=False)
+    stale: bool = False
+
+    @property
+    def cache_engine(self) -> Engine:
+        """Return engine of the cache file, create the file and its tables when needed."""
+        if self.engine is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.engine = create_engine(f"sqlite:///{self.path}")
+            metadata.create_all(self.engine)
+        return self.engine
+
+    @property
+    def synced_at(self) -> float | None:
+        """Return time of the last refresh from the current database, or None if never refreshed from it."""
+        with self.cache_engine.connect() as connection:
+            return connection.scalar(select(sync.c.synced_at).where(sync.c.database == database_key()))
+
+    def is_stale(self) -> bool:
+        """Return True if the cache is older than its time to live or has invalidated subscriptions."""
+        synced_at = self.synced_at
+        return self.stale or synced_at is None or time() - synced_at > settings.ORCHESTRATOR_SHELL_CACHE_TTL
+
+    def refresh(self, full: bool = False) -> tuple[int, int]:
+        """Fetch added and changed subscriptions, or all with full, remove deleted ones, return both numbers.
+
+        Every refresh scans the ids and versions of all subscriptions, only the full rows are fetched incrementally.
+        """
+        database_versions: dict[UUID, int] = dict(
+            db.session.execute(select(SubscriptionTable.subscription_id, SubscriptionTable.version)).tuples().all()
+        )
+        with self.cache_engine.begin() as connection:
+            if full or connection.scalar(select(sync.c.database)) not in (None, database_key()):
+                # start over when asked to, or when the cache is a snapshot of another database
+                connection.execute(delete(cached_subscriptions))
+                connection.execute(delete(sync))
+            cached_versions: dict[UUID, int] = dict(
+                connection.execute(select(cached_subscriptions.c.subscription_id, cached_subscriptions.c.version))
+                .tuples()
+                .all()
+            )
+            changed = [
+                subscription_id
+                for subscription_id, version in database_versions.items()
+                if cached_versions.get(subscription_id) != version
+            ]
+            deleted = [
+                subscription_id for subscription_id in cached_versions if subscription_id not in database_versions
+            ]
+            chunk_size = settings.ORCHESTRATOR_SHELL_CHUNK_SIZE
+            for start in range(0, len(changed), chunk_size):
+                chunk = changed[start : start + chunk_size]
+                connection.execute(
+                    delete(cached_subscriptions).where(cached_subscriptions.c.subscription_id.in_(chunk))
+                )
+                connection.execute(insert(cached_subscriptions), fetch_subscriptions(chunk))
+            for start in range(0, len(deleted), chunk_size):
+                connection.execute(
+                    delete(cached_subscriptions).where(
+                        cached_subscriptions.c.subscription_id.in_(deleted[start : start + chunk_size])
+                    )
+                )
+            connection.execute(delete(sync))
+            connection.execute(insert(sync), {"database": database_key(), "synced_at": time()})
+        self.stale = False
+        return len(changed), len(deleted)
+
+    def invalidate(self, subscription_ids: Iterable[UUID]) -> None:
+        """Have subscriptions that were changed by this shell refetched on the next use of the cache."""
+        if self.engine is None and not self.path.exists():
+            return
+        subscription_ids = list(subscription_ids)
+        chunk_size = settings.ORCHESTRATOR_SHELL_CHUNK_SIZE
+        with self.cache_engine.begin() as connection:
+            for start in range(0, len(subscription_ids), chunk_size):
+                connection.execute(
+                    update(cached_subscriptions)
+                    .where(cached_subscriptions.c.subscription_id.in_(subscription_ids[start : start + chunk_size]))
+                    .values(version=-1)
+                )
+        self.stale = True
+
+    def listed(self, regular_expression: str | None, limit: int | None = None, offset: int = 0) -> list[Row]:
+        """Return sorted list of optionally filtered subscriptions from the cache, refresh it first when stale."""
+        query = select(cached_subscriptions.c.description, cached_subscriptions.c.subscription_id).order_by(
+            cached_subscriptions.c.description, cached_subscriptions.c.subscription_id
+        )
+        if regular_expression is not None:
+            query = query.where(cached_description_matches(regular_expression))
+        if self.is_stale():
+            self.refresh()
+        with self.cache_engine.connect() as connection:
+            return list(connection.execute(query.limit(limit).offset(offset)).all())
+
+    def count(self, regular_expression: str) -> int:
+        """Return number of cached subscriptions with description matching regular expression."""
+        query = select(func.count()).where(cached_description_matches(regular_expression))
+        if self.is_stale():
+            self.refresh()
+        with self.cache_engine.connect() as connection:
+            return connection.scalar(query) or 0
+
+    def status(self) -> list[tuple[str, str | int]]:
+        """Return list of tuples with cache status information."""
+        synced_at = self.synced_at
+        with self.cache_engine.connect() as connection:
+            number_of_subscriptions = connection.scalar(select(func.count()).select_from(cached_subscriptions)) or 0
+        return [
+            ("file", str(self.path)),
+            ("cached subscriptions", number_of_subscriptions),
+            ("seconds since refresh", round(time() - synced_at) if synced_at is not None else "never refreshed"),
+            ("time to live", settings.ORCHESTRATOR_SHELL_CACHE_TTL),
+            ("stale", "yes" if self.is_stale() else "no"),
+            ("refresh", "scans ids and versions of all subscriptions, fetches added and changed ones"),
+        ]
+
+
+def cached_description_matches(regular_expression: str) -> ColumnElement[bool]:
+    """Return case insensitive match on cached description, evaluated by SQLite with the Python re module."""
+    try:
+        re.compile(regular_expression)
+    except re.error as re_error:
+        raise ValueError(f"invalid regular expression: {re_error}") from re_error
+    return cached_subscriptions.c.description.regexp_match(f"(?i){regular_expression}")
+
+
+def fetch_subscriptions(subscription_ids: list[UUID]) -> list[dict]:
+    """Return the cached columns of subscriptions from the database."""
+    return [
+        row._asdict()
+        for row in db.session.execute(
+            select(
+                SubscriptionTable.subscription_id,
+                SubscriptionTable.description,
+                SubscriptionTable.status,
+                ProductTable.name.label("product"),
+                SubscriptionTable.customer_id,
+                SubscriptionTable.version,
+            )
+            .join(SubscriptionTable.product)
+            .where(SubscriptionTable.subscription_id.in_(subscription_ids))
+        )
+    ]
+
+
+subscription_cache = SubscriptionCache(settings.ORCHESTRATOR_SHELL_CACHE_FILE)
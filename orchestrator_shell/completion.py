@@ -0,0 +1,149 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import re
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from itertools import accumulate, islice
+from typing import Generic, TypeVar
+
+V = TypeVar("V")
+
+# maximum number of completions offered at once, type more to narrow them down
+MAX_COMPLETIONS = 100
+
+# a selection that is looked up as index instead of as name, negative indexes are rejected as out of range
+INDEX_PATTERN = re.compile(r"-?[0-9]+")
+
+
+@dataclass
+class PrefixIndex(Generic[V]):
+    """Case insensitive index of names to values, for completion and lookup by name without database queries.
+
+    The names are held as a sorted array of case folded keys, a prefix selects a range of it with two binary searches.
+    For fuzzy matching the keys are also held as a single string with every key on a line of its own, that is searched
+    with the fast substring search of str instead of a loop in Python.
+    """
+
+    keys: list[str] = field(default_factory=list, repr=False)
+    names: list[str] = field(default_factory=list, repr=False)
+    values: list[V] = field(default_factory=list, repr=False)
+    lines: str = field(default="", repr=False)
+    # position of the newline before every key in lines
+    line_starts: list[int] = field(default_factory=list, repr=False)
+
+    @classmethod
+    def build(cls, named_values: Iterable[tuple[str, V]]) -> "PrefixIndex[V]":
+        """Return index of the (name, value) pairs."""
+        names, values = [], []
+        for name, value in named_values:
+            names.append(name)
+            values.append(value)
+        unsorted_keys = [name.casefold().replace("\n", " ") for name in names]
+        order = sorted(range(len(names)), key=unsorted_keys.__getitem__)
+        keys = [unsorted_keys[position] for position in order]
+        return cls(
+            keys=keys,
+            names=[names[position] for position in order],
+            values=[values[position] for position in order],
+            lines="".join(f"\n{key}" for key in keys),
+            line_starts=list(accumulate((len(key) + 1 for key in keys[:-1]), initial=0)) if keys else [],
+        )
+
+    def __len__(self) -> int:
+        """Return number of indexed names."""
+        return len(self.keys)
+
+    def prefix_range(self, prefix: str) -> range:
+        """Return range of positions of the names that start with prefix."""
+        key = prefix.casefold()
+        start = bisect_left(self.keys, key)
+        return range(start, bisect_left(self.keys, key + "\U0010ffff", start))
+
+    def named(self, name: str) -> list[V]:
+        """Return values of name, there can be more than one value with the same name."""
+        key = name.casefold()
+        start = bisect_left(self.keys, key)
+        return self.values[start : bisect_right(self.keys, key, start)]
+
+    def unique(self, name: str, kind: str) -> V:
+        """Return the value of name, raise ValueError when there is no or more than one kind with that name."""
+        if len(values := self.named(name)) == 1:
+            return values[0]
+        if not values:
+            raise ValueError(f"no {kind} named {name}")
+        raise ValueError(f"{len(values)} {kind}s named {name}, select by index instead")
+
+    def positions_containing(self, fragment: str) -> Iterator[int]:
+        """Yield positions of the keys that contain fragment, in order."""
+        start = position = 0
+        while (found := self.lines.find(fragment, start)) != -1:
+            position = bisect_right(self.line_starts, found, position) - 1
+            yield position
+            if position + 1 == len(self.line_starts):
+                return
+            start = self.line_starts[position + 1]
+
+    def fuzzy_positions(self, text: str, limit: int) -> list[int]:
+        """Return positions of the first limit names that contain every whitespace separated fragment of text.
+
+        Only the names with the fragment that occurs least often are checked for the other fragments.
+        """
+        if not (fragments := text.casefold().split()):
+            return []
+        occurrences = [self.lines.count(fragment) for fragment in fragments]
+        if not all(occurrences):
+            return []
+        rarest = fragments[occurrences.index(min(occurrences))]
+        others = [fragment for fragment in dict.fromkeys(fragments) if fragment != rarest]
+        keys = self.keys
+        return list(
+            islice(
+                (
+                    position
+                    for position in self.positions_containing(rarest)
+                    if all(fragment in keys[position] for fragment in others)
+                ),
+                limit,
+            )
+        )
+
+    def complete(self, text: str, limit: int = MAX_COMPLETIONS) -> list[str]:
+        """Return the names that start with text, or the names that contain all fragments of text when none does.
+
+        When more than limit names start with text, the first limit - 1 are returned together with the last, so that
+        the common prefix that completion fills in is the one of all names.
+        """
+        if prefixed := self.prefix_range(text):
+            if len(prefixed) > limit:
+                return [*self.names[prefixed.start : prefixed.start + limit - 1], self.names[prefixed.stop - 1]]
+            return self.names[prefixed.start : prefixed.stop]
+        return [self.names[position] for position in self.fuzzy_positions(text, limit)]
+
+
+def complete_words(index: PrefixIndex, words: list[str]) -> list[str]:
+    """Return completions of the last of the words of a name that was typed without quotes.
+
+    Only the last word is replaced on completion, so the completions are the rest of the names that start with the
+    words before it.
+    """
+    typed = " ".join(words)
+    if not (before := typed[: len(typed) - len(words[-1])]):
+        return index.complete(typed)
+    return [name[len(before) :] for name in index.complete(typed) if name.casefold().startswith(before.casefold())]
+
+
+def is_index(selection: str) -> bool:
+    """Return True when selection is an index number, also when negative, instead of a name."""
+    return INDEX_PATTERN.fullmatch(selection) is not None
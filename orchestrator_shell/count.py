@@ -0,0 +1,104 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from typing import Literal
+
+from orchestrator.db import (
+    ProductBlockTable,
+    ProductTable,
+    ResourceTypeTable,
+    SubscriptionInstanceTable,
+    SubscriptionInstanceValueTable,
+    SubscriptionTable,
+    db,
+)
+from sqlalchemy import ColumnElement, Select, func, select
+
+from orchestrator_shell.output import Record, render_table
+from orchestrator_shell.state import description_matches, invalid_regular_expression
+
+Period = Literal["year", "month", "day"]
+
+# format of a timestamp truncated to a period, for PostgreSQL to_char and for the strftime of SQLite
+PERIOD_FORMATS = {
+    "year": ("YYYY", "%Y"),
+    "month": ("YYYY-MM", "%Y-%m"),
+    "day": ("YYYY-MM-DD", "%Y-%m-%d"),
+}
+
+
+def period_column(column: ColumnElement, period: Period) -> ColumnElement:
+    """Return timestamp column truncated to period as text, so that all timestamps in the same period are equal."""
+    postgresql_format, strftime_format = PERIOD_FORMATS[period]
+    if db.engine.dialect.name == "postgresql":
+        return func.to_char(column, postgresql_format)
+    return func.strftime(strftime_format, column)
+
+
+def group_column(group: str, period: Period) -> ColumnElement:
+    """Return the column that is grouped on for group."""
+    return {
+        "status": SubscriptionTable.status,
+        "product": ProductTable.name,
+        "customer": SubscriptionTable.customer_id,
+        "insync": SubscriptionTable.insync,
+        "start_date": period_column(SubscriptionTable.start_date, period),
+        "end_date": period_column(SubscriptionTable.end_date, period),
+        "product_block": ProductBlockTable.name,
+        "resource_type": ResourceTypeTable.resource_type,
+    }[group]
+
+
+def joined(query: Select, groups: list[str]) -> Select:
+    """Return query on subscriptions joined with the tables of the columns that are grouped on."""
+    if "product" in groups:
+        query = query.join(SubscriptionTable.product)
+    if "product_block" in groups or "resource_type" in groups:
+        query = query.join(SubscriptionTable.instances)
+    if "product_block" in groups:
+        query = query.join(SubscriptionInstanceTable.product_block)
+    if "resource_type" in groups:
+        query = query.join(SubscriptionInstanceTable.values).join(SubscriptionInstanceValueTable.resource_type)
+    return query
+
+
+def count_query(groups: list[str], regular_expression: str | None, period: Period, top: int | None) -> Select:
+    """Return query for the number of subscriptions per combination of groups, optionally matching regular expression.
+
+    Grouped by product block or resource type, the product blocks and the values are counted as well, and the
+    subscriptions are counted once per group instead of once per product block or value.
+    """
+    columns = [group_column(group, period).label(group) for group in groups]
+    instances = "product_block" in groups or "resource_type" in groups
+    counts = [
+        (func.count(SubscriptionTable.subscription_id.distinct()) if instances else func.count()).label("subscriptions")
+    ]
+    if instances:
+        counts.append(func.count(SubscriptionInstanceTable.subscription_instance_id.distinct()).label("product_blocks"))
+    if "resource_type" in groups:
+        counts.append(func.count().label("values"))
+    query = joined(select(*columns, *counts).select_from(SubscriptionTable), groups)
+    if regular_expression is not None:
+        query = query.where(description_matches(regular_expression))
+    query = query.group_by(*columns)
+    if top is None:
+        return query.order_by(*columns)
+    return query.order_by(counts[0].desc(), *columns).limit(top)
+
+
+def count(groups: list[str], regular_expression: str | None, period: Period, top: int | None) -> str:
+    """Implementation of the 'count' command."""
+    with invalid_regular_expression():
+        rows = db.session.execute(count_query(groups, regular_expression, period, top)).all()
+    records: list[Record] = [row._asdict() for row in rows]
+    return render_table(records)
@@ -0,0 +1,90 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections.abc import Iterable
+from contextvars import ContextVar
+from typing import Any, cast
+
+from orchestrator.db import db, wrapped_db
+from orchestrator.db.database import ENGINE_ARGUMENTS, BaseModel, Database, SearchQuery, WrappedSession
+from sqlalchemy import create_engine, make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from orchestrator_shell.settings import settings
+
+# the default of SQLAlchemy, explicit because the number of concurrent audit queries is capped on it
+POOL_MAX_OVERFLOW = 10
+
+
+def engine_arguments(database_url: str) -> dict[str, Any]:
+    """Return the orchestrator-core engine arguments with the pool and statement cache settings of the shell.
+
+    The connect arguments of orchestrator-core are PostgreSQL specific, and left out for the SQLite of the benchmarks.
+    """
+    arguments = ENGINE_ARGUMENTS | {
+        "pool_size": settings.ORCHESTRATOR_SHELL_POOL_SIZE,
+        "max_overflow": POOL_MAX_OVERFLOW,
+        "pool_pre_ping": settings.ORCHESTRATOR_SHELL_POOL_PRE_PING,
+        "pool_recycle": settings.ORCHESTRATOR_SHELL_POOL_RECYCLE,
+        "query_cache_size": settings.ORCHESTRATOR_SHELL_STATEMENT_CACHE_SIZE,
+    }
+    if make_url(database_url).get_backend_name() == "sqlite":
+        del arguments["connect_args"]
+    return arguments
+
+
+def pool_capacity() -> int:
+    """Return the number of connections the pool of the shell hands out before callers have to wait for one."""
+    return settings.ORCHESTRATOR_SHELL_POOL_SIZE + POOL_MAX_OVERFLOW
+
+
+class ShellDatabase(Database):
+    """Orchestrator-core database with an engine and sessions that suit an interactive shell.
+
+    The engine of orchestrator-core is sized for an API server, and its sessions expire all loaded objects on commit.
+    The constructor of Database is not called, it would create that engine only to have it replaced.
+    """
+
+    def __init__(self, database_url: str) -> None:
+        """Create the engine and sessions of the shell for database_url."""
+        self.request_context: ContextVar[str] = ContextVar("request_context", default="")
+        self.engine = create_engine(database_url, **engine_arguments(database_url))
+        self.session_factory = sessionmaker(
+            bind=self.engine,
+            class_=WrappedSession,
+            autocommit=False,
+            autoflush=True,
+            expire_on_commit=settings.ORCHESTRATOR_SHELL_EXPIRE_ON_COMMIT,
+            query_cls=SearchQuery,
+        )
+        self.scoped_session = scoped_session(self.session_factory, self._scopefunc)
+        BaseModel.set_query(cast(SearchQuery, self.scoped_session.query_property()))
+
+
+def init_database(database_url: str | None = None) -> Database:
+    """Initialise the orchestrator-core database of the shell, on DATABASE_URI unless database_url is given."""
+    database = ShellDatabase(database_url or str(settings.DATABASE_URI))
+    wrapped_db.update(database)
+    return database
+
+
+def expire_loaded(
+    entity: type[BaseModel], primary_keys: Iterable[Any], attribute_names: list[str] | None = None
+) -> None:
+    """Expire the objects with these primary keys that are loaded in the session, to refresh only them on next use.
+
+    Needed after statements that change rows without the ORM when loaded objects are not expired on commit.
+    """
+    for primary_key in primary_keys:
+        if (loaded := db.session.identity_map.get(db.session.identity_key(entity, primary_key))) is not None:
+            db.session.expire(loaded, attribute_names)
@@ -0,0 +1,244 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from time import perf_counter
+from typing import Any, NamedTuple
+from uuid import UUID
+
+from orchestrator.db import (
+    SubscriptionInstanceTable,
+    SubscriptionInstanceValueTable,
+    SubscriptionTable,
+    db,
+    transactional,
+)
+from sqlalchemy import insert, update
+from structlog import get_logger
+
+from orchestrator_shell.cache import subscription_cache
+from orchestrator_shell.database import expire_loaded
+from orchestrator_shell.output import Record, is_table_format, render_table
+from orchestrator_shell.state import state
+
+logger = get_logger(__name__)
+
+FieldValue = str | bool | datetime | None
+
+
+class StagedField(NamedTuple):
+    """Staged change of a subscription field."""
+
+    description: str
+    old_value: FieldValue
+    new_value: FieldValue
+
+
+class StagedValue(NamedTuple):
+    """Staged change of a resource type value, inserted when subscription_instance_value_id is None."""
+
+    subscription_id: UUID
+    description: str
+    product_block: str
+    resource_type: str
+    subscription_instance_value_id: UUID | None
+    old_value: str | None
+    new_value: str
+
+
+@dataclass
+class EditBuffer:
+    """Subscription and resource type updates that are held back until they are committed in one transaction.
+
+    Changes are keyed on what they change, so changing the same field or value again replaces the staged new value,
+    and changing it back to its old value drops the change.
+    """
+
+    active: bool = False
+    fields: dict[tuple[UUID, str], StagedField] = field(default_factory=dict)
+    values: dict[tuple[UUID, UUID], StagedValue] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        """Return number of staged changes."""
+        return len(self.fields) + len(self.values)
+
+    def clear(self) -> None:
+        """Stop staging and forget all staged changes."""
+        self.active = False
+        self.fields.clear()
+        self.values.clear()
+
+    def stage_field(self, subscription: SubscriptionTable, field_name: str, new_value: FieldValue) -> None:
+        """Stage new value of field of subscription."""
+        key = (subscription.subscription_id, field_name)
+        staged = self.fields.get(key) or StagedField(
+            subscription.description, getattr(subscription, field_name), new_value
+        )
+        if staged.old_value == new_value:
+            self.fields.pop(key, None)
+        else:
+            self.fields[key] = staged._replace(new_value=new_value)
+
+    def stage_value(
+        self,
+        product_block: SubscriptionInstanceTable,
+        resource_type: SubscriptionInstanceValueTable,
+        new_value: str,
+    ) -> None:
+        """Stage new value of resource type of product block, unset resource types are staged to be inserted."""
+        key = (product_block.subscription_instance_id, resource_type.resource_type_id)
+        staged = self.values.get(key) or StagedValue(
+            product_block.subscription_id,
+            product_block.subscription.description,
+            product_block.product_block.name,
+            resource_type.resource_type.resource_type,
+            resource_type.subscription_instance_value_id if resource_type.value is not None else None,
+            resource_type.value,
+            new_value,
+        )
+        if staged.old_value == new_value:
+            self.values.pop(key, None)
+        else:
+            self.values[key] = staged._replace(new_value=new_value)
+
+
+edit_buffer = EditBuffer()
+
+
+def edit_begin() -> None:
+    """Implementation of the 'edit begin' subcommand."""
+    if edit_buffer.active:
+        raise ValueError("already editing, first commit or rollback")
+    edit_buffer.active = True
+
+
+def edit_records() -> list[Record]:
+    """Return records of the staged changes, sorted on subscription and what they change."""
+    unset = "<unset or non-scalar>" if is_table_format() else None
+    fields: list[Record] = [
+        {
+            "subscription": staged.description,
+            "product block": "",
+            "change": field_name,
+            "old": staged.old_value,
+            "new": staged.new_value,
+        }
+        for (_, field_name), staged in edit_buffer.fields.items()
+    ]
+    values: list[Record] = [
+        {
+            "subscription": staged.description,
+            "product block": staged.product_block,
+            "change": staged.resource_type,
+            "old": staged.old_value if staged.old_value is not None else unset,
+            "new": staged.new_value,
+        }
+        for staged in edit_buffer.values.values()
+    ]
+    return sorted(
+        fields + values, key=lambda record: (record["subscription"], record["product block"], record["change"])
+    )
+
+
+def edit_diff() -> str:
+    """Implementation of the 'edit diff' subcommand."""
+    if not edit_buffer.active:
+        raise ValueError("not editing, first begin")
+    if not edit_buffer and is_table_format():
+        return "no staged changes"
+    return render_table(edit_records())
+
+
+def write_staged() -> None:
+    """Write the staged changes with one bulk statement per table, without loading the changed rows."""
+    subscription_updates: dict[UUID, dict[str, Any]] = {}
+    for (subscription_id, field_name), staged_field in edit_buffer.fields.items():
+        subscription_updates.setdefault(subscription_id, {"subscription_id": subscription_id})[field_name] = (
+            staged_field.new_value
+        )
+    value_updates = [
+        {"subscription_instance_value_id": staged.subscription_instance_value_id, "value": staged.new_value}
+        for staged in edit_buffer.values.values()
+        if staged.subscription_instance_value_id is not None
+    ]
+    value_inserts = [
+        {
+            "subscription_instance_id": subscription_instance_id,
+            "resource_type_id": resource_type_id,
+            "value": staged.new_value,
+        }
+        for (subscription_instance_id, resource_type_id), staged in edit_buffer.values.items()
+        if staged.subscription_instance_value_id is None
+    ]
+    if subscription_updates:
+        db.session.execute(update(SubscriptionTable), list(subscription_updates.values()))
+    if value_updates:
+        db.session.execute(update(SubscriptionInstanceValueTable), value_updates)
+    if value_inserts:
+        db.session.execute(insert(SubscriptionInstanceValueTable), value_inserts)
+
+
+def expire_staged() -> None:
+    """Expire the loaded objects changed by the staged changes, and nothing else in the session."""
+    for subscription_id, field_name in edit_buffer.fields:
+        expire_loaded(SubscriptionTable, [subscription_id], [field_name])
+    expire_loaded(
+        SubscriptionInstanceValueTable,
+        [
+            staged.subscription_instance_value_id
+            for staged in edit_buffer.values.values()
+            if staged.subscription_instance_value_id
+        ],
+        ["value"],
+    )
+    expire_loaded(
+        SubscriptionInstanceTable,
+        [
+            subscription_instance_id
+            for (subscription_instance_id, _), staged in edit_buffer.values.items()
+            if staged.subscription_instance_value_id is None
+        ],
+        ["values"],
+    )
+
+
+def edit_commit() -> str:
+    """Implementation of the 'edit commit' subcommand, the staged changes are kept when the transaction fails."""
+    if not edit_buffer.active:
+        raise ValueError("not editing, first begin")
+    start_time = perf_counter()
+    with state.writing(), transactional(db, logger):
+        write_staged()
+    expire_staged()
+    subscription_cache.invalidate(
+        {subscription_id for subscription_id, _ in edit_buffer.fields}
+        | {staged.subscription_id for staged in edit_buffer.values.values()}
+    )
+    if any(field_name == "description" for _, field_name in edit_buffer.fields):
+        state.forget_descriptions()
+    summary = (
+        f"committed {len(edit_buffer.fields)} subscription fields and {len(edit_buffer.values)} resource type values"
+        f" in {perf_counter() - start_time:.2f} seconds"
+    )
+    edit_buffer.clear()
+    return summary
+
+
+def edit_rollback() -> str:
+    """Implementation of the 'edit rollback' subcommand."""
+    if not edit_buffer.active:
+        raise ValueError("not editing, first begin")
+    summary = f"discarded {len(edit_buffer)} staged changes"
+    edit_buffer.clear()
+    return summary
@@ -0,0 +1,182 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import csv
+import gzip
+from collections.abc import Generator
+from contextlib import closing
+from pathlib import Path
+from time import perf_counter
+from typing import IO, Literal
+
+from orchestrator.db import (
+    ProductBlockTable,
+    ResourceTypeTable,
+    SubscriptionInstanceRelationTable,
+    SubscriptionInstanceTable,
+    SubscriptionInstanceValueTable,
+    SubscriptionTable,
+    db,
+)
+from sqlalchemy import Connection, Select, select
+
+from orchestrator_shell.output import json_record
+from orchestrator_shell.state import description_matches, validate_regular_expression
+
+ExportFormat = Literal["csv", "ndjson"]
+
+# rows fetched per round trip from the server side cursor
+EXPORT_BATCH_SIZE = 10_000
+
+# zlib default, level 9 of gzip.open makes compression instead of the database the bottleneck
+COMPRESSLEVEL = 6
+
+
+def export_queries(regular_expression: str | None) -> dict[str, Select]:
+    """Return query per exported table, optionally only for subscriptions with description matching regular expression.
+
+    The columns are the ones of the details of subscriptions, product blocks and resource types.
+    """
+    subscriptions = select(
+        SubscriptionTable.description,
+        SubscriptionTable.subscription_id,
+        SubscriptionTable.status,
+        SubscriptionTable.product_id,
+        SubscriptionTable.customer_id,
+        SubscriptionTable.insync,
+        SubscriptionTable.start_date,
+        SubscriptionTable.end_date,
+        SubscriptionTable.note,
+    ).order_by(SubscriptionTable.subscription_id)
+    product_blocks = (
+        select(
+            ProductBlockTable.name,
+            SubscriptionInstanceTable.subscription_instance_id,
+            SubscriptionInstanceTable.subscription_id,
+            SubscriptionInstanceTable.product_block_id,
+            SubscriptionInstanceTable.label,
+        )
+        .join(SubscriptionInstanceTable.product_block)
+        .join(SubscriptionInstanceTable.subscription)
+        .order_by(SubscriptionInstanceTable.subscription_id, SubscriptionInstanceTable.subscription_instance_id)
+    )
+    resource_types = (
+        select(
+            ResourceTypeTable.resource_type,
+            SubscriptionInstanceValueTable.value,
+            SubscriptionInstanceValueTable.subscription_instance_value_id,
+            SubscriptionInstanceValueTable.subscription_instance_id,
+            SubscriptionInstanceValueTable.resource_type_id,
+        )
+        .join(SubscriptionInstanceValueTable.resource_type)
+        .join(SubscriptionInstanceValueTable.subscription_instance)
+        .join(SubscriptionInstanceTable.subscription)
+        .order_by(
+            SubscriptionInstanceValueTable.subscription_instance_id,
+            SubscriptionInstanceValueTable.subscription_instance_value_id,
+        )
+    )
+    relations = (
+        select(
+            SubscriptionInstanceRelationTable.in_use_by_id,
+            SubscriptionInstanceRelationTable.depends_on_id,
+            SubscriptionInstanceRelationTable.order_id,
+            SubscriptionInstanceRelationTable.domain_model_attr,
+        )
+        .join(
+            SubscriptionInstanceTable,
+            SubscriptionInstanceTable.subscription_instance_id == SubscriptionInstanceRelationTable.in_use_by_id,
+        )
+        .join(SubscriptionInstanceTable.subscription)
+        .order_by(
+            SubscriptionInstanceRelationTable.in_use_by_id,
+            SubscriptionInstanceRelationTable.domain_model_attr,
+            SubscriptionInstanceRelationTable.order_id,
+        )
+    )
+    queries = {
+        "subscriptions": subscriptions,
+        "product_blocks": product_blocks,
+        "resource_types": resource_types,
+        "product_block_relations": relations,
+    }
+    if regular_expression is None:
+        return queries
+    return {table: query.where(description_matches(regular_expression)) for table, query in queries.items()}
+
+
+def copy_csv(connection: Connection, query: Select, file: IO[str]) -> int:
+    """Write result of query as CSV with header to file with PostgreSQL COPY, return number of rows written."""
+    statement = query.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True})
+    with closing(connection.connection.cursor()) as cursor:
+        cursor.copy_expert(f"COPY ({statement}) TO STDOUT WITH (FORMAT csv, HEADER)", file)
+        return cursor.rowcount
+
+
+def fetch_rows(
+    connection: Connection, query: Select, file: IO[str], export_format: ExportFormat, batch_size: int
+) -> Generator[int, None, None]:
+    """Write result of query to file as CSV with header or as NDJSON, fetched in batches from a server side cursor.
+
+    Yields the number of rows written after every batch.
+    """
+    result = connection.execute(query.execution_options(yield_per=batch_size))
+    writer = csv.writer(file)
+    if export_format == "csv":
+        writer.writerow(result.keys())
+    for batch in result.partitions():
+        if export_format == "csv":
+            writer.writerows(batch)
+        else:
+            file.writelines(f"{json_record(row._asdict())}\n" for row in batch)
+        yield len(batch)
+
+
+def export(
+    directory: Path,
+    export_format: ExportFormat,
+    regular_expression: str | None,
+    batch_size: int,
+    overwrite: bool,
+) -> Generator[str, None, None]:
+    """Implementation of the 'export' command, yielding progress after every batch or, with COPY, every table.
+
+    All tables are read in one repeatable read transaction on a connection of its own, so that they are exported from
+    the same snapshot of the database.
+    """
+    if regular_expression is not None:
+        # fail before any file is written, COPY would raise a driver error instead
+        validate_regular_expression(regular_expression)
+    directory.mkdir(parents=True, exist_ok=True)
+    start_time = perf_counter()
+    total = 0
+    with db.engine.connect() as connection:
+        postgresql = connection.dialect.name == "postgresql"
+        if postgresql:
+            connection.execution_options(isolation_level="REPEATABLE READ")
+        for table, query in export_queries(regular_expression).items():
+            path = directory / f"{table}.{export_format}.gz"
+            table_start_time = perf_counter()
+            with gzip.open(
+                path, "wt" if overwrite else "xt", compresslevel=COMPRESSLEVEL, encoding="utf-8", newline=""
+            ) as file:
+                if postgresql and export_format == "csv":
+                    rows = copy_csv(connection, query, file)
+                else:
+                    rows = 0
+                    for batch_rows in fetch_rows(connection, query, file, export_format, batch_size):
+                        rows += batch_rows
+                        yield f"{table}: {rows} rows"
+            total += rows
+            yield f"{table}: {rows} rows written to {path} in {perf_counter() - table_start_time:.2f} seconds"
+    yield f"exported {total} rows in {perf_counter() - start_time:.2f} seconds"
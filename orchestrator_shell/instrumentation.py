@@ -0,0 +1,213 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import re
+import threading
+from collections import deque
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from cProfile import Profile
+from dataclasses import dataclass, field
+from functools import wraps
+from math import ceil
+from pathlib import Path
+from statistics import fmean
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, ParamSpec, TypeVar
+
+from orchestrator_shell.settings import settings
+
+if TYPE_CHECKING:
+    from sqlalchemy import Engine
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+# number of most recent commands that the stats command summarises
+STATS_WINDOW = 1000
+
+
+@dataclass
+class CommandTiming:
+    """Measurements of a single command."""
+
+    command: str
+    wall_time: float = 0.0
+    sql_statements: int = 0
+    sql_time: float = 0.0
+    rows: int = 0
+    render_time: float = 0.0
+
+    @property
+    def report(self) -> str:
+        """Return measurements on a single line."""
+        return (
+            f"wall {self.wall_time * 1000:.1f} ms, "
+            f"sql {self.sql_statements} statements {self.sql_time * 1000:.1f} ms, "
+            f"rows {self.rows}, "
+            f"render {self.render_time * 1000:.1f} ms"
+        )
+
+
+@dataclass
+class Instrumentation:
+    """Measure wall time, SQL statements, ORM rows loaded and render time of the commands of the shell.
+
+    Only the thread that runs the commands is measured, queries of the background prefetch are left out.
+    """
+
+    timings: deque[CommandTiming] = field(default_factory=lambda: deque(maxlen=STATS_WINDOW))
+    report: bool = False
+    profile: bool = False
+    current: CommandTiming | None = None
+    command_thread: int | None = None
+    start_time: float = 0.0
+    profiler: Profile | None = None
+    render_depth: int = 0
+    installed: bool = False
+
+    def measured(self) -> bool:
+        """Return True when a command is running and the caller is on the thread that runs it."""
+        return self.current is not None and threading.get_ident() == self.command_thread
+
+    def start(self, command: str) -> None:
+        """Start measuring command, and profiling it when enabled."""
+        self.current = CommandTiming(command)
+        self.command_thread = threading.get_ident()
+        self.render_depth = 0
+        if self.profile:
+            self.profiler = Profile()
+            self.profiler.enable()
+        self.start_time = perf_counter()
+
+    def stop(self) -> CommandTiming | None:
+        """Stop measuring the current command and return its measurements, or None if no command was measured."""
+        if (timing := self.current) is None:
+            return None
+        timing.wall_time = perf_counter() - self.start_time
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.current = None
+        self.timings.append(timing)
+        return timing
+
+    def dump_profile(self) -> Path | None:
+        """Write the profile of the last command to the profile directory and return its path, if profiled."""
+        if (profiler := self.profiler) is None:
+            return None
+        self.profiler = None
+        if not self.profile:
+            # the command that turned profiling off
+            return None
+        settings.ORCHESTRATOR_SHELL_PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        command = re.sub(r"\W+", "_", self.timings[-1].command)
+        path = settings.ORCHESTRATOR_SHELL_PROFILE_DIR / f"{len(self.timings):04d}_{command}.prof"
+        profiler.dump_stats(path)
+        return path
+
+    def statement(self, seconds: float) -> None:
+        """Count SQL statement that took seconds."""
+        if self.current is not None and self.measured():
+            self.current.sql_statements += 1
+            self.current.sql_time += seconds
+
+    def row(self) -> None:
+        """Count ORM object loaded from a row."""
+        if self.current is not None and self.measured():
+            self.current.rows += 1
+
+    @contextmanager
+    def rendering(self) -> Iterator:
+        """Add time spent in the outermost rendering function, minus the SQL it triggers, to the render time."""
+        if self.current is None or not self.measured() or self.render_depth:
+            self.render_depth += 1
+            try:
+                yield
+            finally:
+                self.render_depth -= 1
+            return
+        timing = self.current
+        sql_time = timing.sql_time
+        self.render_depth += 1
+        start_time = perf_counter()
+        try:
+            yield
+        finally:
+            self.render_depth -= 1
+            timing.render_time += perf_counter() - start_time - (timing.sql_time - sql_time)
+
+
+instrumentation = Instrumentation()
+
+
+def rendering(func: Callable[P, R]) -> Callable[P, R]:
+    """Measure time spent in function as render time of the current command."""
+
+    @wraps(func)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+        with instrumentation.rendering():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def install_listeners(engine: "Engine") -> None:
+    """Count statements executed on engine and ORM objects loaded, once the database is initialised."""
+    if instrumentation.installed:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.orm import Mapper
+
+    def before_cursor_execute(connection: Any, *args: Any) -> None:  # noqa: ANN401, ARG001
+        connection.info.setdefault("query_start_time", []).append(perf_counter())
+
+    def after_cursor_execute(connection: Any, *args: Any) -> None:  # noqa: ANN401, ARG001
+        instrumentation.statement(perf_counter() - connection.info["query_start_time"].pop())
+
+    def load(*args: Any) -> None:  # noqa: ANN401, ARG001
+        instrumentation.row()
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(Mapper, "load", load)
+    instrumentation.installed = True
+
+
+def percentile(values: list[float], percent: int) -> float:
+    """Return nearest rank percentile of sorted values."""
+    return values[max(ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def stats() -> list[dict[str, Any]]:
+    """Implementation of the 'stats' command, return summary per command of the recent commands."""
+    commands: dict[str, list[CommandTiming]] = {}
+    for timing in instrumentation.timings:
+        commands.setdefault(timing.command, []).append(timing)
+    records = []
+    for command, timings in sorted(commands.items()):
+        wall_times = sorted(timing.wall_time * 1000 for timing in timings)
+        records.append(
+            {
+                "command": command,
+                "count": len(timings),
+                "p50 ms": round(percentile(wall_times, 50), 3),
+                "p90 ms": round(percentile(wall_times, 90), 3),
+                "p99 ms": round(percentile(wall_times, 99), 3),
+                "max ms": round(wall_times[-1], 3),
+                "sql statements": round(fmean(timing.sql_statements for timing in timings), 1),
+                "sql ms": round(fmean(timing.sql_time * 1000 for timing in timings), 3),
+                "rows": round(fmean(timing.rows for timing in timings), 1),
+                "render ms": round(fmean(timing.render_time * 1000 for timing in timings), 3),
+            }
+        )
+    return records
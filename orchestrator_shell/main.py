@@ -11,18 +11,40 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import os
+import subprocess
 from argparse import Namespace
-from datetime import datetime
-
-from cmd2 import Cmd, Cmd2ArgumentParser, Statement, with_argparser
-from orchestrator.db import init_database
-
-import orchestrator_shell.product_block
-import orchestrator_shell.resource_type
-import orchestrator_shell.state
-import orchestrator_shell.subscripition
+from collections.abc import Callable, Generator, Iterable
+from contextlib import closing
+from functools import partial
+from pathlib import Path
+from time import perf_counter
+from typing import TYPE_CHECKING, Any
+
+from cmd2 import Cmd, Cmd2ArgumentParser, Completions, Settable, Statement, plugin, with_argparser
+from cmd2.exceptions import Cmd2ArgparseError
+
+import orchestrator_shell.batch
+import orchestrator_shell.completion
+import orchestrator_shell.instrumentation
+import orchestrator_shell.startup
+from orchestrator_shell.output import FORMATS, render_table
 from orchestrator_shell.settings import settings
-from orchestrator_shell.state import state
+from orchestrator_shell.startup import lazy_import, record_milestone
+
+if TYPE_CHECKING:
+    import orchestrator_shell.audit
+    import orchestrator_shell.count
+    import orchestrator_shell.edit
+    import orchestrator_shell.export
+    import orchestrator_shell.product_block
+    import orchestrator_shell.resource_type
+    import orchestrator_shell.state
+    import orchestrator_shell.subscripition
+else:
+    # these modules import orchestrator-core and SQLAlchemy, that take seconds, only load them when first used
+    for module in ("state", "product_block", "resource_type", "subscripition", "export", "audit", "count", "edit"):
+        lazy_import(f"orchestrator_shell.{module}")
 
 
 class OrchestratorShell(Cmd):
@@ -30,44 +52,270 @@ class OrchestratorShell(Cmd):
 
     intro = "Welcome to the WFO shell.\n" "Type help or ? to list commands."
 
-    def __init__(self) -> None:
-        """WFO shell initialisation."""
+    def __init__(self, batch: bool = False) -> None:
+        """WFO shell initialisation, in batch mode command line arguments and history are left alone."""
         super().__init__(
-            persistent_history_file=str(settings.ORCHESTRATOR_SHELL_HISTFILE),
+            allow_cli_args=not batch,
+            persistent_history_file="" if batch else str(settings.ORCHESTRATOR_SHELL_HISTFILE),
             persistent_history_length=settings.ORCHESTRATOR_SHELL_HISTFILE_SIZE,
         )
         self.prompt = "(wfo) "
-        self.hidden_commands.extend(["alias", "edit", "macro", "run_pyscript", "run_script", "shell", "shortcuts"])
-        init_database(settings)  # type: ignore[arg-type]
+        self.hidden_commands.extend(["alias", "macro", "run_pyscript", "run_script", "shell", "shortcuts"])
+        self.add_settable(
+            Settable(
+                "page_size",
+                int,
+                "number of subscriptions per page, 0 disables paging",
+                settings,
+                settable_attrib_name="ORCHESTRATOR_SHELL_PAGE_SIZE",
+            )
+        )
+        self.add_settable(
+            Settable(
+                "prefetch",
+                bool,
+                "load the product blocks of a selected subscription in the background",
+                settings,
+                settable_attrib_name="ORCHESTRATOR_SHELL_PREFETCH",
+            )
+        )
+        self.add_settable(
+            Settable(
+                "prefetch_depth",
+                int,
+                "number of depends on and in use by levels loaded together with a selected subscription",
+                settings,
+                settable_attrib_name="ORCHESTRATOR_SHELL_PREFETCH_DEPTH",
+            )
+        )
+        self.add_settable(
+            Settable(
+                "stream",
+                bool,
+                "stream long listings line by line while they are fetched",
+                settings,
+                settable_attrib_name="ORCHESTRATOR_SHELL_STREAM",
+            )
+        )
+        self.add_settable(
+            Settable(
+                "format",
+                str,
+                "output format of list and details commands",
+                settings,
+                settable_attrib_name="ORCHESTRATOR_SHELL_FORMAT",
+                choices=FORMATS,
+            )
+        )
+        self.add_settable(
+            Settable(
+                "cache",
+                bool,
+                "list and search subscriptions from a local snapshot of the database",
+                settings,
+                settable_attrib_name="ORCHESTRATOR_SHELL_CACHE",
+            )
+        )
+        self.add_settable(
+            Settable(
+                "cache_ttl",
+                int,
+                "number of seconds before the local snapshot is refreshed on its next use",
+                settings,
+                settable_attrib_name="ORCHESTRATOR_SHELL_CACHE_TTL",
+            )
+        )
+        self.register_precmd_hook(self.start_instrumentation)
+        self.register_postcmd_hook(self.stop_instrumentation)
+        self.database_initialised = False
+        self.command_failed = False
+        record_milestone("shell initialised")
+
+    def preloop(self) -> None:
+        """Record startup time until the first prompt."""
+        record_milestone("first prompt")
+
+    def init_database(self) -> None:
+        """Initialise the database connection before the first command that uses it."""
+        if not self.database_initialised:
+            from orchestrator_shell.database import init_database
+
+            database = init_database()
+            orchestrator_shell.instrumentation.install_listeners(database.engine)
+            self.database_initialised = True
+            record_milestone("database initialised")
+
+    def start_instrumentation(self, data: plugin.PrecommandData) -> plugin.PrecommandData:
+        """Start measuring the command that is about to run."""
+        orchestrator_shell.instrumentation.instrumentation.start(" ".join(data.statement.argv[:2]))
+        return data
+
+    def stop_instrumentation(self, data: plugin.PostcommandData) -> plugin.PostcommandData:
+        """Stop measuring the command that just ran, and report on it when timing or profiling is on."""
+        instrumentation = orchestrator_shell.instrumentation.instrumentation
+        if (timing := instrumentation.stop()) is not None and instrumentation.report:
+            self.pfeedback(timing.report)
+        if (path := instrumentation.dump_profile()) is not None:
+            self.pfeedback(f"profile written to {path}")
+        return data
+
+    def pwarning(self, *objects: Any, **kwargs: Any) -> None:  # noqa: ANN401
+        """Print warning to stderr and mark the current command as failed."""
+        self.command_failed = True
+        super().pwarning(*objects, **kwargs)
+
+    def pexcept(self, exception: BaseException, **kwargs: Any) -> None:  # noqa: ANN401
+        """Print exception to stderr and mark the current command as failed."""
+        self.command_failed = True
+        super().pexcept(exception, **kwargs)
+
+    def default(self, statement: Statement) -> bool | None:
+        """Report unknown command and mark it as failed."""
+        self.command_failed = True
+        return super().default(statement)
+
+    def onecmd(self, statement: Statement | str, *, add_to_history: bool = True) -> bool:
+        """Execute command, and mark it as failed when its arguments are invalid."""
+        try:
+            return super().onecmd(statement, add_to_history=add_to_history)
+        except Cmd2ArgparseError:
+            self.command_failed = True
+            raise
+
+    def run_batch(self, commands: Iterable[str], keep_going: bool, status: bool) -> int:
+        """Run commands non-interactively in this shell and return the exit code.
+
+        All commands share one database session and state. Unless keep_going is set, the first failing command stops
+        the batch. With status set, a machine-readable status line per command is written to stderr.
+        """
+        exit_code = orchestrator_shell.batch.EXIT_OK
+        for command in commands:
+            self.command_failed = False
+            start_time = perf_counter()
+            try:
+                stop = self.onecmd_plus_hooks(command, add_to_history=False, raise_keyboard_interrupt=True)
+            except KeyboardInterrupt:
+                return orchestrator_shell.batch.EXIT_INTERRUPTED
+            if status:
+                orchestrator_shell.batch.write_status(
+                    orchestrator_shell.batch.batch_status(command, self.command_failed, perf_counter() - start_time)
+                )
+            if self.command_failed:
+                exit_code = orchestrator_shell.batch.EXIT_COMMAND_FAILED
+                if not keep_going:
+                    break
+            if stop:
+                break
+        return exit_code or self.exit_code
 
     def do_exit(self, line: Statement) -> bool:  # noqa: ARG002
         """Exit the application."""
         return True
 
+    def pstream(self, lines: Generator[str, None, None]) -> None:
+        """Write lines as they are produced, through the pager when interactive, stop on Ctrl-C or pager exit."""
+        functional_terminal = self.stdin.isatty() and self.stdout.isatty() and os.environ.get("TERM") is not None
+        can_block = not (self._redirecting or self.in_pyscript() or self.in_script())
+        with closing(lines):
+            try:
+                if functional_terminal and can_block:
+                    with subprocess.Popen(  # noqa: S602
+                        self.pager_chop, shell=True, stdin=subprocess.PIPE, stdout=self.stdout, text=True
+                    ) as pager:
+                        for line in lines:
+                            pager.stdin.write(f"{line}\n")  # type: ignore[union-attr]
+                else:
+                    for line in lines:
+                        self.stdout.write(f"{line}\n")
+            except BrokenPipeError:
+                pass
+            except KeyboardInterrupt:
+                self.pwarning("interrupted")
+
     # subcommand functions for the subscription command
     def subscription_list(self, args: Namespace) -> None:  # noqa: ARG002
         """List subcommand of subscription command."""
-        self.poutput(orchestrator_shell.subscripition.subscription_list())
+        if settings.ORCHESTRATOR_SHELL_STREAM and not settings.ORCHESTRATOR_SHELL_PAGE_SIZE:
+            self.pstream(orchestrator_shell.subscripition.subscription_list_stream())
+        else:
+            self.poutput(orchestrator_shell.subscripition.subscription_list())
+
+    def subscription_page(self, args: Namespace) -> None:
+        """Page subcommand of subscription command."""
+        if not settings.ORCHESTRATOR_SHELL_PAGE_SIZE:
+            self.pwarning("set page_size to enable paging")
+        elif args.page < 0:
+            self.pwarning("page number should not be negative")
+        elif subscription_page := orchestrator_shell.subscripition.subscription_page(args.page):
+            self.poutput(subscription_page)
+        else:
+            self.pwarning(f"no subscriptions on page {args.page}")
+
+    def subscription_next(self, args: Namespace) -> None:  # noqa: ARG002
+        """Next subcommand of subscription command."""
+        if orchestrator_shell.state.state.page is None:
+            self.pwarning("list subscriptions with paging enabled first")
+        elif subscription_page := orchestrator_shell.subscripition.subscription_page(
+            orchestrator_shell.state.state.page + 1
+        ):
+            self.poutput(subscription_page)
+        else:
+            self.pwarning("already on last page")
+
+    def subscription_prev(self, args: Namespace) -> None:  # noqa: ARG002
+        """Prev subcommand of subscription command."""
+        if orchestrator_shell.state.state.page is None:
+            self.pwarning("list subscriptions with paging enabled first")
+        elif orchestrator_shell.state.state.page == 0:
+            self.pwarning("already on first page")
+        else:
+            self.poutput(orchestrator_shell.subscripition.subscription_page(orchestrator_shell.state.state.page - 1))
 
     def subscription_search(self, args: Namespace) -> None:
         """Search subcommand of subscription command."""
-        self.poutput(orchestrator_shell.subscripition.subscription_search(args.regular_expression))
+        if args.limit is not None and args.limit < 1:
+            self.pwarning("limit should be at least 1")
+            return
+        if args.limit is not None and settings.ORCHESTRATOR_SHELL_PAGE_SIZE:
+            self.pwarning("limit cannot be combined with paging, set page_size to 0 first")
+            return
+        try:
+            if args.count:
+                self.poutput(orchestrator_shell.subscripition.subscription_search_count(args.regular_expression))
+            else:
+                self.poutput(orchestrator_shell.subscripition.subscription_search(args.regular_expression, args.limit))
+        except ValueError as value_error:
+            self.pwarning(str(value_error))
 
     def subscription_select(self, args: Namespace) -> None:
         """Select subcommand of subscription command."""
-        number_of_subscriptions = (
-            len(state.filtered_subscriptions) if state.filtered_subscriptions is not None else len(state.subscriptions)
-        )
-        if not number_of_subscriptions:
+        if not orchestrator_shell.completion.is_index(selection := " ".join(args.selection)):
+            try:
+                self.poutput(orchestrator_shell.subscripition.subscription_select_description(selection))
+            except ValueError as value_error:
+                self.pwarning(str(value_error))
+        elif not (number_of_subscriptions := len(orchestrator_shell.state.state.subscriptions)):
             self.pwarning("list or search for subscriptions first")
-        elif not 0 <= args.index < number_of_subscriptions:
+        elif not 0 <= int(selection) < number_of_subscriptions:
             self.pwarning(f"selected subscription index not between 0 and {number_of_subscriptions - 1}")
         else:
-            self.poutput(orchestrator_shell.subscripition.subscription_select(args.index))
+            self.poutput(orchestrator_shell.subscripition.subscription_select(int(selection)))
+
+    def complete_selection(
+        self,
+        *_: str | int,
+        names: Callable[[], orchestrator_shell.completion.PrefixIndex],
+        arg_tokens: dict[str, list[str]],
+    ) -> Completions:
+        """Complete the selection argument, typed without quotes, with the names in the index returned by names."""
+        self.init_database()
+        return Completions.from_values(
+            orchestrator_shell.completion.complete_words(names(), arg_tokens["selection"]), is_sorted=True
+        )
 
     def subscription_details(self, args: Namespace) -> None:
         """Details subcommand of subscription command."""
-        if state.subscription_index is None:
+        if orchestrator_shell.state.state.subscription is None:
             self.pwarning("first select a subscription")
         else:
             self.poutput(
@@ -76,42 +324,60 @@ class OrchestratorShell(Cmd):
                 )
             )
 
-    def subscription_update(self, args: Namespace) -> None:  # noqa: C901
+    def subscription_update(self, args: Namespace) -> None:
         """Update subcommand of subscription command."""
-        if state.subscription_index is None:
+        if args.all_filtered and orchestrator_shell.state.state.search is None:
+            self.pwarning("first search for subscriptions")
+            return
+        if not args.all_filtered and orchestrator_shell.state.state.subscription is None:
             self.pwarning("first select a subscription")
             return
-        if args.field in ["insync"]:
-            if args.new_value.lower() in ["y", "yes", "true"]:
-                args.new_value = True
-            elif args.new_value.lower() in ["n", "no", "false"]:
-                args.new_value = False
-            else:
-                self.pwarning("expected y, yes, true, n, no or false")
-                return
-        if args.field in ["start_date", "end_date"]:
-            if args.new_value == "":
-                args.new_value = None
+        if args.chunk_size < 1:
+            self.pwarning("chunk size must be at least 1")
+            return
+        try:
+            new_value = orchestrator_shell.subscripition.parse_field_value(args.field, args.new_value)
+            if args.all_filtered:
+                for progress in orchestrator_shell.subscripition.subscription_update_filtered(
+                    args.field, new_value, args.chunk_size
+                ):
+                    self.poutput(progress)
             else:
-                try:
-                    args.new_value = datetime.fromisoformat(args.new_value)
-                except ValueError as value_error:
-                    self.pwarning(str(value_error))
-                    return
-                if args.new_value.tzinfo is None:
-                    args.new_value = args.new_value.astimezone()
-        orchestrator_shell.subscripition.subscription_update(args.field, args.new_value)
+                orchestrator_shell.subscripition.subscription_update(args.field, new_value)
+        except ValueError as value_error:
+            self.pwarning(str(value_error))
+
+    def subscription_cache(self, args: Namespace) -> None:
+        """Cache subcommand of subscription command."""
+        self.poutput(orchestrator_shell.subscripition.subscription_cache_status(refresh=args.refresh, full=args.full))
 
     # subscription (sub)commands argument parsers
     s_parser = Cmd2ArgumentParser()
     s_subparser = s_parser.add_subparsers(title="subscription subcommands")
     s_list_parser = s_subparser.add_parser("list", help="list all subscriptions from database")
     s_list_parser.set_defaults(func=subscription_list)
+    s_page_parser = s_subparser.add_parser("page", help="list page of subscriptions from database")
+    s_page_parser.add_argument("page", type=int, help="page number starting at 0")
+    s_page_parser.set_defaults(func=subscription_page)
+    s_next_parser = s_subparser.add_parser("next", help="list next page of subscriptions")
+    s_next_parser.set_defaults(func=subscription_next)
+    s_prev_parser = s_subparser.add_parser("prev", help="list previous page of subscriptions")
+    s_prev_parser.set_defaults(func=subscription_prev)
     s_search_parser = s_subparser.add_parser("search", help="case insensitive search subscription descriptions")
     s_search_parser.add_argument("regular_expression", type=str, help="match description on regular expression")
+    s_search_parser.add_argument("--limit", type=int, help="list at most this number of subscriptions")
+    s_search_parser.add_argument("--count", action="store_true", help="only show number of matching subscriptions")
     s_search_parser.set_defaults(func=subscription_search)
     s_select_parser = s_subparser.add_parser("select", help="select subscription to work on")
-    s_select_parser.add_argument("index", type=int, help="select by index number")
+    s_select_parser.add_argument(
+        "selection",
+        metavar="index|description",
+        nargs="+",
+        help="select by index number, or by description with tab completion",
+        completer=partial(
+            complete_selection, names=lambda: orchestrator_shell.subscripition.subscription_names()
+        ),
+    )
     s_select_parser.set_defaults(func=subscription_select)
     s_details_parser = s_subparser.add_parser("details", help="show subscription details")
     s_details_parser.add_argument("--subscription_only", action="store_true", help="show subscription details only")
@@ -132,13 +398,27 @@ class OrchestratorShell(Cmd):
         help="subscription field",
     )
     s_update_parser.add_argument("new_value", type=str, help="new value for selected subscription field")
+    s_update_parser.add_argument(
+        "--all-filtered", action="store_true", help="update all subscriptions matching the last search instead"
+    )
+    s_update_parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=settings.ORCHESTRATOR_SHELL_CHUNK_SIZE,
+        help="number of subscriptions to update per transaction",
+    )
     s_update_parser.set_defaults(func=subscription_update)
+    s_cache_parser = s_subparser.add_parser("cache", help="show status of or refresh local subscription snapshot")
+    s_cache_parser.add_argument("--refresh", action="store_true", help="fetch added and changed subscriptions")
+    s_cache_parser.add_argument("--full", action="store_true", help="fetch all subscriptions again")
+    s_cache_parser.set_defaults(func=subscription_cache)
 
     # subscription command
     @with_argparser(s_parser)
     def do_subscription(self, args: Namespace) -> None:
         """List, search or select subscriptions, update fields, and show details."""
         if func := getattr(args, "func", None):
+            self.init_database()
             func(self, args)
         else:
             self.do_help("subscription")
@@ -146,23 +426,30 @@ class OrchestratorShell(Cmd):
     # subcommand functions for the product_block command
     def product_block_list(self, args: Namespace) -> None:  # noqa: ARG002
         """List subcommand of product_block command."""
-        if state.subscription_index is None:
+        if orchestrator_shell.state.state.subscription is None:
             self.pwarning("first select a subscription")
+        elif settings.ORCHESTRATOR_SHELL_STREAM:
+            self.pstream(orchestrator_shell.product_block.product_block_list_stream())
         else:
             self.poutput(orchestrator_shell.product_block.product_block_list())
 
     def product_block_select(self, args: Namespace) -> None:
         """Select subcommand of product_block command."""
-        if not (number_of_product_blocks := len(state.selected_product_blocks)):
+        if not (number_of_product_blocks := len(orchestrator_shell.state.state.selected_product_blocks)):
             self.pwarning("list or search for product_blocks first")
-        elif not 0 <= args.index < number_of_product_blocks:
+        elif not orchestrator_shell.completion.is_index(selection := " ".join(args.selection)):
+            try:
+                self.poutput(orchestrator_shell.product_block.product_block_select_name(selection))
+            except ValueError as value_error:
+                self.pwarning(str(value_error))
+        elif not 0 <= int(selection) < number_of_product_blocks:
             self.pwarning(f"selected product_block index not between 0 and {number_of_product_blocks - 1}")
         else:
-            self.poutput(orchestrator_shell.product_block.product_block_select(args.index))
+            self.poutput(orchestrator_shell.product_block.product_block_select(int(selection)))
 
     def product_block_details(self, args: Namespace) -> None:
         """Details subcommand of product_block command."""
-        if state.product_block_index is None:
+        if orchestrator_shell.state.state.product_block_index is None:
             self.pwarning("first select a product_block")
         else:
             self.poutput(
@@ -176,9 +463,9 @@ class OrchestratorShell(Cmd):
 
     def product_block_depends_on(self, args: Namespace) -> None:
         """Depends_on subcommand of product_block command."""
-        if state.product_block_index is None:
+        if orchestrator_shell.state.state.product_block_index is None:
             self.pwarning("first select a product block")
-        elif not (number_of_depends_on := len(state.selected_product_block.depends_on)):
+        elif not (number_of_depends_on := len(orchestrator_shell.state.state.selected_product_block.depends_on)):
             self.pwarning("no depend on product blocks")
         elif not 0 <= args.index < number_of_depends_on:
             self.pwarning(f"selected product_block index not between 0 and {number_of_depends_on - 1}")
@@ -187,22 +474,37 @@ class OrchestratorShell(Cmd):
 
     def product_block_in_use_by(self, args: Namespace) -> None:
         """In_use_by subcommand of product_block command."""
-        if state.product_block_index is None:
+        if orchestrator_shell.state.state.product_block_index is None:
             self.pwarning("first select a product block")
-        elif not (number_of_in_use_by := len(state.selected_product_block.in_use_by)):
+        elif not (number_of_in_use_by := len(orchestrator_shell.state.state.selected_product_block.in_use_by)):
             self.pwarning("no in use by product blocks")
         elif not 0 <= args.index < number_of_in_use_by:
             self.pwarning(f"selected product_block index not between 0 and {number_of_in_use_by - 1}")
         else:
             self.poutput(orchestrator_shell.product_block.product_block_in_use_by(args.index))
 
+    def product_block_closure(self, args: Namespace) -> None:
+        """Dependencies and impact subcommands of product_block command."""
+        if orchestrator_shell.state.state.product_block_index is None:
+            self.pwarning("first select a product block")
+        elif args.depth < 1:
+            self.pwarning("depth should be at least 1")
+        else:
+            self.poutput(orchestrator_shell.product_block.product_block_closure(args.direction, args.depth, args.flat))
+
     # product_block (sub)commands argument parsers
     pb_parser = Cmd2ArgumentParser()
     pb_subparser = pb_parser.add_subparsers(title="product_block subcommands")
     pb_list_parser = pb_subparser.add_parser("list", help="list product blocks of current selected subscription")
     pb_list_parser.set_defaults(func=product_block_list)
     pb_select_parser = pb_subparser.add_parser("select", help="select product block to work on")
-    pb_select_parser.add_argument("index", type=int, help="select by index number")
+    pb_select_parser.add_argument(
+        "selection",
+        metavar="index|name",
+        nargs="+",
+        help="select by index number, or by name with tab completion",
+        completer=partial(complete_selection, names=lambda: orchestrator_shell.state.state.product_block_names),
+    )
     pb_select_parser.set_defaults(func=product_block_select)
     pb_details_parser = pb_subparser.add_parser("details", help="show product block details")
     pb_details_parser.add_argument("--product_block_only", action="store_true", help="show product block details only")
@@ -216,12 +518,25 @@ class OrchestratorShell(Cmd):
     pb_is_use_by_parser = pb_subparser.add_parser("in_use_by", help="show in use by product blocks")
     pb_is_use_by_parser.add_argument("index", type=int, help="select by index number")
     pb_is_use_by_parser.set_defaults(func=product_block_in_use_by)
+    pb_dependencies_parser = pb_subparser.add_parser(
+        "dependencies", help="show product blocks the selected one depends on, directly or indirectly"
+    )
+    pb_dependencies_parser.add_argument("--depth", type=int, default=10, help="follow at most this number of relations")
+    pb_dependencies_parser.add_argument("--flat", action="store_true", help="list every product block once with depth")
+    pb_dependencies_parser.set_defaults(func=product_block_closure, direction="dependencies")
+    pb_impact_parser = pb_subparser.add_parser(
+        "impact", help="show product blocks that use the selected one, directly or indirectly"
+    )
+    pb_impact_parser.add_argument("--depth", type=int, default=10, help="follow at most this number of relations")
+    pb_impact_parser.add_argument("--flat", action="store_true", help="list every product block once with depth")
+    pb_impact_parser.set_defaults(func=product_block_closure, direction="impact")
 
     # product_block command
     @with_argparser(pb_parser)
     def do_product_block(self, args: Namespace) -> None:
         """List and select product blocks, show details, or follow depends on and in use by product blocks."""
         if func := getattr(args, "func", None):
+            self.init_database()
             func(self, args)
         else:
             self.do_help("product_block")
@@ -229,53 +544,121 @@ class OrchestratorShell(Cmd):
     # subcommand functions for the resource_type command
     def resource_type_list(self, args: Namespace) -> None:  # noqa: ARG002
         """List subcommand of resource_type command."""
-        if state.product_block_index is None:
+        if orchestrator_shell.state.state.product_block_index is None:
             self.pwarning("first select a product block")
         else:
             self.poutput(orchestrator_shell.resource_type.resource_type_list())
 
     def resource_type_select(self, args: Namespace) -> None:
         """Select subcommand of resource_type command."""
-        if not (number_of_resource_types := len(state.selected_resource_types)):
+        if not (number_of_resource_types := len(orchestrator_shell.state.state.selected_resource_types)):
             self.pwarning("list or search for resource_types first")
-        elif not 0 <= args.index < number_of_resource_types:
+        elif not orchestrator_shell.completion.is_index(selection := " ".join(args.selection)):
+            try:
+                self.poutput(orchestrator_shell.resource_type.resource_type_select_name(selection))
+            except ValueError as value_error:
+                self.pwarning(str(value_error))
+        elif not 0 <= int(selection) < number_of_resource_types:
             self.pwarning(f"selected resource_type index not between 0 and {number_of_resource_types - 1}")
         else:
-            self.poutput(orchestrator_shell.resource_type.resource_type_select(args.index))
+            self.poutput(orchestrator_shell.resource_type.resource_type_select(int(selection)))
 
     def resource_type_details(self, args: Namespace) -> None:  # noqa: ARG002
         """Details subcommand of resource_type command."""
-        if state.resource_type_index is None:
+        if orchestrator_shell.state.state.resource_type_index is None:
             self.pwarning("first select a resource_type")
         else:
             self.poutput(orchestrator_shell.resource_type.resource_type_details())
 
     def resource_type_update(self, args: Namespace) -> None:
         """Update subcommand of resource_type command."""
-        if state.resource_type_index is None:
+        if orchestrator_shell.state.state.resource_type_index is None:
             self.pwarning("first select a resource_type")
         else:
             orchestrator_shell.resource_type.resource_type_update(args.new_value)
 
+    def resource_type_search(self, args: Namespace) -> None:
+        """Search subcommand of resource_type command."""
+        if args.limit is not None and args.limit < 1:
+            self.pwarning("limit should be at least 1")
+            return
+        try:
+            self.poutput(
+                orchestrator_shell.resource_type.resource_type_search(
+                    args.resource_type, args.regular_expression, args.limit
+                )
+            )
+        except ValueError as value_error:
+            self.pwarning(str(value_error))
+
+    def resource_type_bulk_update(self, args: Namespace) -> None:
+        """Bulk update subcommand of resource_type command."""
+        if args.search is None and args.product is None and args.file is None:
+            self.pwarning("select subscriptions with --search, --product and/or --file")
+        elif args.chunk_size < 1:
+            self.pwarning("chunk size must be at least 1")
+        else:
+            try:
+                mapping = orchestrator_shell.resource_type.load_value_mapping(args.file) if args.file else None
+                for progress in orchestrator_shell.resource_type.resource_type_bulk_update(
+                    args.resource_type, args.search, args.product, args.value, mapping, args.dry_run, args.chunk_size
+                ):
+                    self.poutput(progress)
+            except (OSError, ValueError) as error:
+                self.pwarning(str(error))
+
     # resource_type (sub)commands argument parsers
     rt_parser = Cmd2ArgumentParser()
     rt_subparser = rt_parser.add_subparsers(title="resource_type subcommands")
     rt_list_parser = rt_subparser.add_parser("list", help="list resource types of current selected product block")
     rt_list_parser.set_defaults(func=resource_type_list)
     rt_select_parser = rt_subparser.add_parser("select", help="select resource type to work on")
-    rt_select_parser.add_argument("index", type=int, help="select by index number")
+    rt_select_parser.add_argument(
+        "selection",
+        metavar="index|name",
+        nargs="+",
+        help="select by index number, or by name with tab completion",
+        completer=partial(complete_selection, names=lambda: orchestrator_shell.state.state.resource_type_names),
+    )
     rt_select_parser.set_defaults(func=resource_type_select)
     rt_details_parser = rt_subparser.add_parser("details", help="show resource type details")
     rt_details_parser.set_defaults(func=resource_type_details)
     rt_update_parser = rt_subparser.add_parser("update", help="update selected resource type")
     rt_update_parser.add_argument("new_value", type=str, help="new value for selected resource type")
     rt_update_parser.set_defaults(func=resource_type_update)
+    rt_search_parser = rt_subparser.add_parser(
+        "search", help="list subscriptions with a value of resource type matching regular expression"
+    )
+    rt_search_parser.add_argument("resource_type", type=str, help="name of resource type to search")
+    rt_search_parser.add_argument("regular_expression", type=str, help="match value on regular expression")
+    rt_search_parser.add_argument("--limit", type=int, help="maximum number of values to list")
+    rt_search_parser.set_defaults(func=resource_type_search)
+    rt_bulk_update_parser = rt_subparser.add_parser(
+        "bulk_update", help="update resource type of all product blocks of filtered subscriptions"
+    )
+    rt_bulk_update_parser.add_argument("resource_type", type=str, help="name of resource type to update")
+    rt_bulk_update_value_group = rt_bulk_update_parser.add_mutually_exclusive_group(required=True)
+    rt_bulk_update_value_group.add_argument("--value", type=str, help="new value for all product blocks")
+    rt_bulk_update_value_group.add_argument(
+        "--file", type=Path, help="CSV or JSON file that maps subscription_id to new value"
+    )
+    rt_bulk_update_parser.add_argument("--search", type=str, help="only subscriptions matching regular expression")
+    rt_bulk_update_parser.add_argument("--product", type=str, help="only subscriptions of product with this name")
+    rt_bulk_update_parser.add_argument("--dry-run", action="store_true", help="only show number of affected values")
+    rt_bulk_update_parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=settings.ORCHESTRATOR_SHELL_CHUNK_SIZE,
+        help="number of product blocks to write per transaction",
+    )
+    rt_bulk_update_parser.set_defaults(func=resource_type_bulk_update)
 
     # resource_type command
     @with_argparser(rt_parser)
     def do_resource_type(self, args: Namespace) -> None:
-        """List, select and update resource types, and show details."""
+        """List, select, search and update resource types, and show details."""
         if func := getattr(args, "func", None):
+            self.init_database()
             func(self, args)
         else:
             self.do_help("resource_type")
@@ -283,12 +666,12 @@ class OrchestratorShell(Cmd):
     # subcommand functions for the state command
     def state_summary(self, args: Namespace) -> None:  # noqa: ARG002
         """summary subcommand of state command."""
-        if summary := state.summary:
+        if summary := orchestrator_shell.state.state.summary:
             self.poutput(summary)
 
     def state_details(self, args: Namespace) -> None:  # noqa: ARG002
         """details subcommand of state command."""
-        self.poutput(state.details)
+        self.poutput(orchestrator_shell.state.state.details)
 
     # state (sub)commands argument parsers
     state_parser = Cmd2ArgumentParser()
@@ -306,3 +689,189 @@ class OrchestratorShell(Cmd):
             func(self, args)
         else:
             self.do_help("state")
+
+    # subcommand functions for the edit command
+    def edit_begin(self, args: Namespace) -> None:  # noqa: ARG002
+        """Begin subcommand of edit command."""
+        try:
+            orchestrator_shell.edit.edit_begin()
+        except ValueError as value_error:
+            self.pwarning(str(value_error))
+
+    def edit_diff(self, args: Namespace) -> None:  # noqa: ARG002
+        """Diff subcommand of edit command."""
+        try:
+            self.poutput(orchestrator_shell.edit.edit_diff())
+        except ValueError as value_error:
+            self.pwarning(str(value_error))
+
+    def edit_commit(self, args: Namespace) -> None:  # noqa: ARG002
+        """Commit subcommand of edit command."""
+        try:
+            self.poutput(orchestrator_shell.edit.edit_commit())
+        except ValueError as value_error:
+            self.pwarning(str(value_error))
+
+    def edit_rollback(self, args: Namespace) -> None:  # noqa: ARG002
+        """Rollback subcommand of edit command."""
+        try:
+            self.poutput(orchestrator_shell.edit.edit_rollback())
+        except ValueError as value_error:
+            self.pwarning(str(value_error))
+
+    # edit (sub)commands argument parsers
+    edit_parser = Cmd2ArgumentParser()
+    edit_subparser = edit_parser.add_subparsers(title="edit subcommands")
+    edit_begin_parser = edit_subparser.add_parser("begin", help="stage subscription and resource type updates")
+    edit_begin_parser.set_defaults(func=edit_begin)
+    edit_diff_parser = edit_subparser.add_parser("diff", help="show staged updates with old and new values")
+    edit_diff_parser.set_defaults(func=edit_diff)
+    edit_commit_parser = edit_subparser.add_parser("commit", help="write staged updates in one transaction")
+    edit_commit_parser.set_defaults(func=edit_commit)
+    edit_rollback_parser = edit_subparser.add_parser("rollback", help="discard staged updates")
+    edit_rollback_parser.set_defaults(func=edit_rollback)
+
+    # edit command
+    @with_argparser(edit_parser)
+    def do_edit(self, args: Namespace) -> None:
+        """Stage updates, show them, and commit them in one transaction or roll them back."""
+        if func := getattr(args, "func", None):
+            func(self, args)
+        else:
+            self.do_help("edit")
+
+    export_parser = Cmd2ArgumentParser()
+    export_parser.add_argument("directory", type=Path, help="directory to write a compressed file per table to")
+    export_parser.add_argument("--format", choices=["csv", "ndjson"], default="csv", help="format of the files")
+    export_parser.add_argument("--search", type=str, help="only subscriptions matching regular expression")
+    export_parser.add_argument("--batch-size", type=int, help="number of rows fetched at a time when not using COPY")
+    export_parser.add_argument("--force", action="store_true", help="overwrite existing files")
+
+    # export command
+    @with_argparser(export_parser)
+    def do_export(self, args: Namespace) -> None:
+        """Export subscriptions, product blocks, resource types and product block relations to compressed files."""
+        if args.batch_size is not None and args.batch_size < 1:
+            self.pwarning("batch size must be at least 1")
+            return
+        self.init_database()
+        try:
+            for progress in orchestrator_shell.export.export(
+                args.directory,
+                args.format,
+                args.search,
+                args.batch_size or orchestrator_shell.export.EXPORT_BATCH_SIZE,
+                args.force,
+            ):
+                self.poutput(progress)
+        except (OSError, ValueError) as error:
+            self.pwarning(str(error))
+
+    audit_parser = Cmd2ArgumentParser()
+    audit_parser.add_argument(
+        "--check",
+        action="append",
+        choices=["unset", "relations", "status"],
+        help="only run this check, can be repeated (default: all checks)",
+    )
+    audit_parser.add_argument("--search", type=str, help="only subscriptions matching regular expression")
+    audit_parser.add_argument("--chunks", type=int, help="number of subscription id ranges audited separately")
+    audit_parser.add_argument(
+        "--workers", type=int, help="number of id ranges audited concurrently, capped by the connection pool"
+    )
+
+    # audit command
+    @with_argparser(audit_parser)
+    def do_audit(self, args: Namespace) -> None:
+        """Audit subscriptions for unset resource types, dependencies on terminated subscriptions and status."""
+        if (args.chunks is not None and args.chunks < 1) or (args.workers is not None and args.workers < 1):
+            self.pwarning("chunks and workers must be at least 1")
+            return
+        self.init_database()
+        from sqlalchemy.exc import SQLAlchemyError
+
+        try:
+            for progress in orchestrator_shell.audit.audit(
+                args.check or ["unset", "relations", "status"],
+                args.search,
+                args.chunks or orchestrator_shell.audit.AUDIT_CHUNKS,
+                args.workers or orchestrator_shell.audit.AUDIT_WORKERS,
+            ):
+                self.poutput(progress)
+        except ValueError as error:
+            self.pwarning(str(error))
+        except SQLAlchemyError as error:
+            # raised in a worker thread, reported here instead of as a traceback
+            self.pexcept(error)
+
+    count_parser = Cmd2ArgumentParser()
+    count_parser.add_argument(
+        "--by",
+        nargs="+",
+        default=[],
+        choices=[
+            "status",
+            "product",
+            "customer",
+            "insync",
+            "start_date",
+            "end_date",
+            "product_block",
+            "resource_type",
+        ],
+        help="count per value of these (default: count all subscriptions)",
+    )
+    count_parser.add_argument("--search", type=str, help="only subscriptions matching regular expression")
+    count_parser.add_argument(
+        "--period", choices=["year", "month", "day"], default="month", help="period to group start and end dates on"
+    )
+    count_parser.add_argument("--top", type=int, help="only show this number of largest groups")
+
+    # count command
+    @with_argparser(count_parser)
+    def do_count(self, args: Namespace) -> None:
+        """Count subscriptions, product blocks and values per status, product, customer and more."""
+        if args.top is not None and args.top < 1:
+            self.pwarning("top must be at least 1")
+            return
+        self.init_database()
+        try:
+            self.poutput(
+                orchestrator_shell.count.count(list(dict.fromkeys(args.by)), args.search, args.period, args.top)
+            )
+        except ValueError as error:
+            self.pwarning(str(error))
+
+    startup_parser = Cmd2ArgumentParser()
+    startup_parser.add_argument(
+        "--imports", type=int, default=0, help="also show this number of slowest imports at startup"
+    )
+
+    # startup command
+    @with_argparser(startup_parser)
+    def do_startup(self, args: Namespace) -> None:
+        """Show startup timing."""
+        self.poutput(orchestrator_shell.startup.startup_report(args.imports))
+
+    timing_parser = Cmd2ArgumentParser()
+    timing_parser.add_argument("switch", choices=["on", "off"], help="report on every command or not")
+
+    # timing command
+    @with_argparser(timing_parser)
+    def do_timing(self, args: Namespace) -> None:
+        """Report wall time, SQL statements and time, ORM rows loaded and render time after every command."""
+        orchestrator_shell.instrumentation.instrumentation.report = args.switch == "on"
+
+    profile_parser = Cmd2ArgumentParser()
+    profile_parser.add_argument("switch", choices=["on", "off"], help="profile every command or not")
+
+    # profile command
+    @with_argparser(profile_parser)
+    def do_profile(self, args: Namespace) -> None:
+        """Profile every command with cProfile and write the profile to a file per command."""
+        orchestrator_shell.instrumentation.instrumentation.profile = args.switch == "on"
+
+    # stats command
+    def do_stats(self, line: Statement) -> None:  # noqa: ARG002
+        """Show percentiles of the wall time and mean measurements per command for the recent commands."""
+        self.poutput(render_table(orchestrator_shell.instrumentation.stats()))
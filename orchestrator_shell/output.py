@@ -0,0 +1,76 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+from collections.abc import Generator, Iterable
+from datetime import datetime
+from typing import Any
+
+from tabulate import tabulate
+
+from orchestrator_shell.instrumentation import rendering
+from orchestrator_shell.settings import settings
+
+FORMATS = ("table", "json", "ndjson")
+
+Record = dict[str, Any]
+
+
+def is_table_format() -> bool:
+    """Return True when output is formatted as plain text tables, otherwise output is formatted as JSON."""
+    return settings.ORCHESTRATOR_SHELL_FORMAT == "table"
+
+
+def json_value(value: Any) -> str:  # noqa: ANN401
+    """Return JSON representation of values that JSON has no type for, like UUID and datetime."""
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def json_record(record: Record) -> str:
+    """Return record as JSON on a single line."""
+    return json.dumps(record, default=json_value)
+
+
+def record_lines(records: Iterable[Record]) -> Generator[str, None, None]:
+    """Yield records one per line, as the elements of one JSON array or as separate JSON lines for ndjson."""
+    if settings.ORCHESTRATOR_SHELL_FORMAT == "ndjson":
+        for record in records:
+            yield json_record(record)
+        return
+    separator = "["
+    for record in records:
+        yield f"{separator}{json_record(record)}"
+        separator = ","
+    yield "[]" if separator == "[" else "]"
+
+
+@rendering
+def render_records(records: Iterable[Record]) -> str:
+    """Return list of records formatted as JSON or JSON lines."""
+    return "\n".join(record_lines(records))
+
+
+@rendering
+def render_details(details: Record) -> str:
+    """Return details formatted as plain text table of names and values, or as a JSON object."""
+    if is_table_format():
+        return tabulate(details.items(), tablefmt="plain")
+    return json_record(details)
+
+
+@rendering
+def render_table(records: list[Record]) -> str:
+    """Return list of records formatted as plain text table with the record keys as headers, or as JSON."""
+    if is_table_format():
+        return tabulate(records, headers="keys", tablefmt="plain")
+    return render_records(records)
@@ -11,29 +11,58 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from collections.abc import Generator, Sequence
+from uuid import UUID
 
-from orchestrator.db import SubscriptionInstanceTable
+from orchestrator.db import (
+    ProductBlockTable,
+    SubscriptionInstanceRelationTable,
+    SubscriptionInstanceTable,
+    SubscriptionTable,
+    db,
+)
+from sqlalchemy import Integer, Row, Select, literal_column, select
 from tabulate import tabulate
 
-from orchestrator_shell.resource_type import resource_type_table
-from orchestrator_shell.state import all_resource_types, state
+from orchestrator_shell.instrumentation import rendering
+from orchestrator_shell.output import Record, is_table_format, record_lines, render_details, render_records
+from orchestrator_shell.resource_type import resource_type_records, resource_type_table, resource_type_value
+from orchestrator_shell.state import all_resource_types, load_subscription, sorted_resource_types, state
 
+# relation columns to follow from and to, for the dependencies and the impact of a product block
+CLOSURE_DIRECTIONS = {
+    "dependencies": (SubscriptionInstanceRelationTable.in_use_by_id, SubscriptionInstanceRelationTable.depends_on_id),
+    "impact": (SubscriptionInstanceRelationTable.depends_on_id, SubscriptionInstanceRelationTable.in_use_by_id),
+}
 
-def product_block_table(product_blocks: list[SubscriptionInstanceTable]) -> str:
-    """Return indexed table of product blocks."""
-    max_rt_width = max([len(rt.resource_type.resource_type) for pb in product_blocks for rt in all_resource_types(pb)])
+
+def is_plain(text: str) -> bool:
+    """Return True if text is printable ASCII, so that its width on screen equals its length."""
+    return text.isascii() and text.isprintable()
+
+
+def tabulated_product_block_table(rows: list[tuple[str, list[tuple[str, str]]]], width: int) -> str:
+    """Return indexed table of product block rows using nested tabulate, that handles all text widths correctly."""
     return tabulate(
         [
             [
                 tabulate(
                     [
-                        ["name", product_block.product_block.name],
-                        ["resource types", resource_type_table(all_resource_types(product_block), max_rt_width)],
+                        ["name", name],
+                        [
+                            "resource types",
+                            tabulate(
+                                [[rt_name.ljust(width), value] for rt_name, value in resource_types],
+                                tablefmt="plain",
+                                disable_numparse=True,
+                                showindex=True,
+                            ),
+                        ],
                     ],
                     tablefmt="plain",
                 )
             ]
-            for product_block in product_blocks
+            for name, resource_types in rows
         ],
         tablefmt="plain",
         disable_numparse=True,
@@ -41,51 +70,121 @@ def product_block_table(product_blocks: list[SubscriptionInstanceTable]) -> str:
     )
 
 
-def details_product_block(product_block: SubscriptionInstanceTable) -> list[tuple[str, str]]:
-    """Return list of tuples with product block details only."""
-    return [
-        ("name", product_block.product_block.name),
-        ("subscription_instance_id", product_block.subscription_instance_id),
-        ("subscription_id", product_block.subscription_id),
-        ("product_block_id", product_block.product_block_id),
-        ("label", product_block.label),
+def product_block_lines(product_blocks: list[SubscriptionInstanceTable]) -> Generator[str, None, None]:
+    """Yield indexed table of product blocks line by line.
+
+    All rows are computed once, and when all text is plain the table is formatted directly in the same layout as
+    nested tabulate tables, otherwise nested tabulate is used.
+    """
+    rows = [
+        (
+            product_block.product_block.name,
+            [
+                (rt.resource_type.resource_type, resource_type_value(rt))
+                for rt in sorted_resource_types(all_resource_types(product_block))
+            ],
+        )
+        for product_block in product_blocks
     ]
+    width = max((len(rt_name) for _, resource_types in rows for rt_name, _ in resource_types), default=0)
+    if not all(
+        is_plain(name) and all(is_plain(rt_name) and is_plain(value) for rt_name, value in resource_types)
+        for name, resource_types in rows
+    ):
+        yield from tabulated_product_block_table(rows, width).split("\n")
+        return
+    index_width = len(str(len(rows) - 1))
+    for index, (name, resource_types) in enumerate(rows):
+        rt_index_width = len(str(len(resource_types) - 1))
+        product_block_lines = [f"name            {name}"] + [
+            f"{'resource types' if rt_index == 0 else '':14}  {rt_index:<{rt_index_width}}  {rt_name:<{width}}  {value}"
+            for rt_index, (rt_name, value) in enumerate(resource_types)
+        ]
+        if not resource_types:
+            product_block_lines.append("resource types")
+        for line_number, line in enumerate(product_block_lines):
+            yield f"{index if line_number == 0 else '':<{index_width}}  {line}".rstrip()
 
 
-def details_resource_types(product_block: SubscriptionInstanceTable) -> list[tuple[str, str]]:
-    """Return list of tuples with resource type details only."""
-    return [
-        ("resource types", resource_type_table(all_resource_types(product_block))),
-    ]
+@rendering
+def product_block_table(product_blocks: list[SubscriptionInstanceTable]) -> str:
+    """Return indexed table of product blocks."""
+    return "\n".join(product_block_lines(product_blocks))
 
 
-def details_depends_on(product_block: SubscriptionInstanceTable) -> list[tuple[str, str]]:
-    """Return list of tuples with depends on details only."""
+def product_block_records(product_blocks: list[SubscriptionInstanceTable]) -> list[Record]:
+    """Return indexed records of product blocks with their resource types."""
     return [
-        ("depends_on", product_block_table(product_block.depends_on) if product_block.depends_on else ""),
+        {
+            "index": index,
+            "name": product_block.product_block.name,
+            "subscription_instance_id": product_block.subscription_instance_id,
+            "resource_types": resource_type_records(all_resource_types(product_block)),
+        }
+        for index, product_block in enumerate(product_blocks)
     ]
 
 
-def details_in_use_by(product_block: SubscriptionInstanceTable) -> list[tuple[str, str]]:
-    """Return list of tuples with in use by details only."""
-    return [
-        ("in_use_by", product_block_table(product_block.in_use_by) if product_block.in_use_by else ""),
-    ]
+def product_blocks_detail(product_blocks: list[SubscriptionInstanceTable]) -> str | list[Record]:
+    """Return product blocks as nested table, or as records when the output is formatted as JSON."""
+    if is_table_format():
+        return product_block_table(product_blocks) if product_blocks else ""
+    return product_block_records(product_blocks)
+
+
+def details_product_block(product_block: SubscriptionInstanceTable) -> Record:
+    """Return product block details only."""
+    return {
+        "name": product_block.product_block.name,
+        "subscription_instance_id": product_block.subscription_instance_id,
+        "subscription_id": product_block.subscription_id,
+        "product_block_id": product_block.product_block_id,
+        "label": product_block.label,
+    }
+
+
+def details_resource_types(product_block: SubscriptionInstanceTable) -> Record:
+    """Return resource type details only."""
+    resource_types = all_resource_types(product_block)
+    return {
+        "resource types": (
+            resource_type_table(resource_types) if is_table_format() else resource_type_records(resource_types)
+        ),
+    }
+
+
+def details_depends_on(product_block: SubscriptionInstanceTable) -> Record:
+    """Return depends on details only."""
+    return {"depends_on": product_blocks_detail(product_block.depends_on)}
+
 
+def details_in_use_by(product_block: SubscriptionInstanceTable) -> Record:
+    """Return in use by details only."""
+    return {"in_use_by": product_blocks_detail(product_block.in_use_by)}
 
-def details_all(product_block: SubscriptionInstanceTable) -> list[tuple[str, str]]:
-    """Return list of tuples with all product block details."""
+
+def details_all(product_block: SubscriptionInstanceTable) -> Record:
+    """Return all product block details."""
     return (
         details_product_block(product_block)
-        + details_resource_types(product_block)
-        + details_depends_on(product_block)
-        + details_in_use_by(product_block)
+        | details_resource_types(product_block)
+        | details_depends_on(product_block)
+        | details_in_use_by(product_block)
     )
 
 
 def product_block_list() -> str:
     """Implementation of the 'product_block list' subcommand."""
-    return product_block_table(state.selected_product_blocks)
+    if is_table_format():
+        return product_block_table(state.selected_product_blocks)
+    return render_records(product_block_records(state.selected_product_blocks))
+
+
+def product_block_list_stream() -> Generator[str, None, None]:
+    """Implementation of the 'product_block list' subcommand in streaming mode."""
+    if is_table_format():
+        return product_block_lines(state.selected_product_blocks)
+    return record_lines(product_block_records(state.selected_product_blocks))
 
 
 def product_block_select(index: int) -> str:
@@ -95,28 +194,34 @@ def product_block_select(index: int) -> str:
     return state.summary
 
 
+def product_block_select_name(name: str) -> str:
+    """Implementation of the 'product_block select' subcommand with a name instead of an index."""
+    return product_block_select(state.product_block_names.unique(name, "product block"))
+
+
 def product_block_details(
     product_block_only: bool, resource_types_only: bool, depends_on_only: bool, in_use_by_only: bool
 ) -> str:
     """Implementation of the 'product_block details' subcommand."""
     if product_block_only:
-        return tabulate(details_product_block(state.selected_product_block), tablefmt="plain")
+        return render_details(details_product_block(state.selected_product_block))
     elif resource_types_only:  # noqa: RET505
-        return tabulate(details_resource_types(state.selected_product_block), tablefmt="plain")
+        return render_details(details_resource_types(state.selected_product_block))
     elif depends_on_only:
-        return tabulate(details_depends_on(state.selected_product_block), tablefmt="plain")
+        return render_details(details_depends_on(state.selected_product_block))
     elif in_use_by_only:
-        return tabulate(details_in_use_by(state.selected_product_block), tablefmt="plain")
+        return render_details(details_in_use_by(state.selected_product_block))
     else:
-        return tabulate(details_all(state.selected_product_block), tablefmt="plain")
+        return render_details(details_all(state.selected_product_block))
 
 
 def product_block_depends_on(index: int) -> str:
     """Implementation of the 'product_block depends_on' subcommand."""
     depends_on_product_block = state.selected_product_block.depends_on[index]
-    state.subscription_index = state.subscriptions.index(depends_on_product_block.subscription)
+    state.subscription = load_subscription(depends_on_product_block.subscription_id)
+    state.invalidate_cache()
     # note that the selected_product_blocks list below is of the subscription selected just above
-    state.product_block_index = state.selected_product_blocks.index(depends_on_product_block)
+    state.product_block_index = state.product_block_positions[depends_on_product_block.subscription_instance_id]
     state.resource_type_index = None
     return state.summary
 
@@ -124,8 +229,105 @@ def product_block_depends_on(index: int) -> str:
 def product_block_in_use_by(index: int) -> str:
     """Implementation of the 'product_block in_use_by' subcommand."""
     in_use_by_product_block = state.selected_product_block.in_use_by[index]
-    state.subscription_index = state.subscriptions.index(in_use_by_product_block.subscription)
+    state.subscription = load_subscription(in_use_by_product_block.subscription_id)
+    state.invalidate_cache()
     # note that the selected_product_blocks list below is of the subscription selected just above
-    state.product_block_index = state.selected_product_blocks.index(in_use_by_product_block)
+    state.product_block_index = state.product_block_positions[in_use_by_product_block.subscription_instance_id]
     state.resource_type_index = None
     return state.summary
+
+
+def closure_query(subscription_instance_id: UUID, direction: str, max_depth: int) -> Select:
+    """Return recursive query for all product blocks reachable in direction within max_depth relations.
+
+    Every row is a product block together with the product block it was reached from and the number of relations
+    followed, the depth limit also ends the recursion when the relations contain a cycle.
+    """
+    source, target = CLOSURE_DIRECTIONS[direction]
+    closure = (
+        select(
+            target.label("subscription_instance_id"),
+            source.label("parent_id"),
+            literal_column("1", Integer).label("depth"),
+        )
+        .where(source == subscription_instance_id)
+        .cte("closure", recursive=True)
+    )
+    closure = closure.union(
+        select(target, source, closure.c.depth + 1)
+        .join(closure, source == closure.c.subscription_instance_id)
+        .where(closure.c.depth < max_depth)
+    )
+    return (
+        select(
+            closure.c.subscription_instance_id,
+            closure.c.parent_id,
+            closure.c.depth,
+            ProductBlockTable.name,
+            SubscriptionTable.description,
+        )
+        .select_from(closure)
+        .join(
+            SubscriptionInstanceTable,
+            SubscriptionInstanceTable.subscription_instance_id == closure.c.subscription_instance_id,
+        )
+        .join(ProductBlockTable, ProductBlockTable.product_block_id == SubscriptionInstanceTable.product_block_id)
+        .join(SubscriptionTable, SubscriptionTable.subscription_id == SubscriptionInstanceTable.subscription_id)
+        .order_by(
+            closure.c.depth, ProductBlockTable.name, SubscriptionTable.description, closure.c.subscription_instance_id
+        )
+    )
+
+
+def closure_tree_lines(root: SubscriptionInstanceTable, rows: Sequence[Row]) -> Generator[str, None, None]:
+    """Yield product blocks as tree indented by depth, product blocks already shown are not expanded again."""
+    children: dict[tuple[UUID, int], list[Row]] = {}
+    for row in rows:
+        children.setdefault((row.parent_id, row.depth), []).append(row)
+    yield f"{root.product_block.name}  {state.selected_subscription.description}  {root.subscription_instance_id}"
+    expanded = {root.subscription_instance_id}
+    stack = list(reversed(children.get((root.subscription_instance_id, 1), [])))
+    while stack:
+        row = stack.pop()
+        grandchildren = children.get((row.subscription_instance_id, row.depth + 1), [])
+        shown = row.subscription_instance_id in expanded
+        see_above = "  (see above)" if shown and grandchildren else ""
+        yield f"{'  ' * row.depth}{row.name}  {row.description}  {row.subscription_instance_id}{see_above}"
+        if not shown:
+            expanded.add(row.subscription_instance_id)
+            stack.extend(reversed(grandchildren))
+
+
+def closure_records(rows: Sequence[Row], flat: bool) -> list[Record]:
+    """Return product blocks with their depth, when flat every product block once at its smallest depth."""
+    if flat:
+        # rows are sorted on depth, keep the first row of every product block
+        first_rows: dict[UUID, Row] = {}
+        for row in rows:
+            first_rows.setdefault(row.subscription_instance_id, row)
+        rows = list(first_rows.values())
+    return [
+        {
+            "depth": row.depth,
+            "name": row.name,
+            "subscription": row.description,
+            "subscription_instance_id": row.subscription_instance_id,
+        }
+        | ({} if flat else {"parent_id": row.parent_id})
+        for row in rows
+    ]
+
+
+def product_block_closure(direction: str, max_depth: int, flat: bool) -> str:
+    """Implementation of the 'product_block dependencies' and 'product_block impact' subcommands."""
+    root = state.selected_product_block
+    rows = db.session.execute(closure_query(root.subscription_instance_id, direction, max_depth)).all()
+    if not is_table_format():
+        return render_records(closure_records(rows, flat))
+    if not rows:
+        if direction == "dependencies":
+            return f"{root.product_block.name} depends on no product blocks"
+        return f"no product blocks depend on {root.product_block.name}"
+    if flat:
+        return tabulate(closure_records(rows, flat), headers="keys", tablefmt="plain")
+    return "\n".join(closure_tree_lines(root, rows))
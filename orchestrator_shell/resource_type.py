@@ -12,23 +12,56 @@
 #  limitations under the License.
 
 
+import csv
+import json
+from collections.abc import Generator
+from pathlib import Path
+from uuid import UUID
+
 import tabulate
-from orchestrator.db import SubscriptionInstanceValueTable, db, transactional
+from orchestrator.db import (
+    ProductBlockTable,
+    ProductTable,
+    ResourceTypeTable,
+    SubscriptionInstanceTable,
+    SubscriptionInstanceValueTable,
+    SubscriptionTable,
+    db,
+    transactional,
+)
+from sqlalchemy import ColumnElement, Row, Select, and_, insert, select, update
 from structlog import get_logger
 
-from orchestrator_shell.state import sorted_resource_types, state
+from orchestrator_shell.database import expire_loaded
+from orchestrator_shell.edit import edit_buffer
+from orchestrator_shell.instrumentation import rendering
+from orchestrator_shell.output import Record, is_table_format, render_details, render_records
+from orchestrator_shell.state import (
+    ListedSubscription,
+    description_matches,
+    invalid_regular_expression,
+    regular_expression_matches,
+    sorted_resource_types,
+    state,
+)
 
 logger = get_logger(__name__)
 tabulate.PRESERVE_WHITESPACE = True
 
 
+def resource_type_value(resource_type: SubscriptionInstanceValueTable) -> str:
+    """Return value of resource type, or a placeholder when unset or non-scalar."""
+    return resource_type.value if resource_type.value is not None else "<unset or non-scalar>"
+
+
+@rendering
 def resource_type_table(resource_types: list[SubscriptionInstanceValueTable], width: int = 0) -> str:
     """Return indexed table of resource types, with name optionally aligned on width."""
     return tabulate.tabulate(
         [
             [
                 resource_type.resource_type.resource_type.ljust(width),
-                resource_type.value if resource_type.value is not None else "<unset or non-scalar>",
+                resource_type_value(resource_type),
             ]
             for resource_type in sorted_resource_types(resource_types)
         ],
@@ -38,22 +71,32 @@ def resource_type_table(resource_types: list[SubscriptionInstanceValueTable], wi
     )
 
 
-def details(resource_type: SubscriptionInstanceValueTable | None) -> list[tuple[str, str]]:
-    """Return list of tuples with resource type detail information."""
-    if resource_type is None:
-        return []
+def resource_type_records(resource_types: list[SubscriptionInstanceValueTable]) -> list[Record]:
+    """Return indexed records of resource types, with value None when unset or non-scalar."""
     return [
-        ("resource_type", resource_type.resource_type.resource_type),
-        ("value", resource_type.value),
-        ("subscription_instance_value_id", resource_type.subscription_instance_value_id),
-        ("subscription_instance_id", resource_type.subscription_instance_id),
-        ("resource_type_id", resource_type.resource_type_id),
+        {"index": index, "resource_type": resource_type.resource_type.resource_type, "value": resource_type.value}
+        for index, resource_type in enumerate(sorted_resource_types(resource_types))
     ]
 
 
+def details(resource_type: SubscriptionInstanceValueTable | None) -> Record:
+    """Return resource type detail information."""
+    if resource_type is None:
+        return {}
+    return {
+        "resource_type": resource_type.resource_type.resource_type,
+        "value": resource_type.value,
+        "subscription_instance_value_id": resource_type.subscription_instance_value_id,
+        "subscription_instance_id": resource_type.subscription_instance_id,
+        "resource_type_id": resource_type.resource_type_id,
+    }
+
+
 def resource_type_list() -> str:
     """Implementation of the 'resource_type list' subcommand."""
-    return resource_type_table(state.selected_resource_types)
+    if is_table_format():
+        return resource_type_table(state.selected_resource_types)
+    return render_records(resource_type_records(state.selected_resource_types))
 
 
 def resource_type_select(index: int) -> str:
@@ -62,14 +105,22 @@ def resource_type_select(index: int) -> str:
     return state.summary
 
 
+def resource_type_select_name(name: str) -> str:
+    """Implementation of the 'resource_type select' subcommand with a name instead of an index."""
+    return resource_type_select(state.resource_type_names.unique(name, "resource type"))
+
+
 def resource_type_details() -> str:
     """Implementation of the 'resource_type details' subcommand."""
-    return tabulate.tabulate(details(state.selected_resource_type), tablefmt="plain")
+    return render_details(details(state.selected_resource_type))
 
 
 def resource_type_update(new_value: str) -> None:
-    """Implementation of the 'resource_type update' subcommand."""
-    with transactional(db, logger):
+    """Implementation of the 'resource_type update' subcommand, only staged while editing."""
+    if edit_buffer.active:
+        edit_buffer.stage_value(state.selected_product_block, state.selected_resource_type, new_value)
+        return
+    with state.writing(), transactional(db, logger):
         if state.selected_resource_type.value is None:
             # add previously unset resource type to list of product block values
             state.selected_product_block.values.append(
@@ -80,3 +131,222 @@ def resource_type_update(new_value: str) -> None:
         else:
             # otherwise just update the existing resource type value
             state.selected_resource_type.value = new_value
+
+
+def value_search_query(resource_type_name: str, regular_expression: str) -> Select:
+    """Return query for the values of resource type that match regular expression, in all subscriptions.
+
+    Only the values of the resource type are read, through the index on resource_type_id, and the regular expression
+    is matched case insensitive by the database.
+    """
+    return (
+        select(
+            SubscriptionTable.description,
+            SubscriptionTable.subscription_id,
+            ProductBlockTable.name.label("product_block"),
+            SubscriptionInstanceValueTable.subscription_instance_id,
+            SubscriptionInstanceValueTable.value,
+        )
+        .join(SubscriptionInstanceValueTable.resource_type)
+        .join(SubscriptionInstanceValueTable.subscription_instance)
+        .join(SubscriptionInstanceTable.subscription)
+        .join(SubscriptionInstanceTable.product_block)
+        .where(ResourceTypeTable.resource_type == resource_type_name)
+        .where(regular_expression_matches(SubscriptionInstanceValueTable.value, regular_expression))
+        .order_by(
+            SubscriptionTable.description,
+            SubscriptionTable.subscription_id,
+            ProductBlockTable.name,
+            SubscriptionInstanceValueTable.value,
+        )
+    )
+
+
+@rendering
+def value_search_table(rows: list[Row]) -> str:
+    """Return table of found values, indexed by the position of their subscription in the listed subscriptions."""
+    return tabulate.tabulate(
+        [
+            [
+                state.subscription_positions[row.subscription_id],
+                row.description,
+                row.product_block,
+                row.value,
+                row.subscription_id,
+            ]
+            for row in rows
+        ],
+        tablefmt="plain",
+        disable_numparse=True,
+    )
+
+
+def value_search_records(rows: list[Row]) -> list[Record]:
+    """Return records of found values, indexed by the position of their subscription in the listed subscriptions."""
+    return [{"index": state.subscription_positions[row.subscription_id], **row._asdict()} for row in rows]
+
+
+def resource_type_search(resource_type_name: str, regular_expression: str, limit: int | None) -> str:
+    """Implementation of the 'resource_type search' subcommand.
+
+    The subscriptions with a matching value are added to the state as listed subscriptions, to select them by index.
+    """
+    with invalid_regular_expression():
+        rows = list(db.session.execute(value_search_query(resource_type_name, regular_expression).limit(limit)).all())
+    if not rows and not db.session.scalar(
+        select(ResourceTypeTable.resource_type_id).where(ResourceTypeTable.resource_type == resource_type_name)
+    ):
+        raise ValueError(f"unknown resource type {resource_type_name}")
+    state.list_subscriptions(
+        list(dict.fromkeys(ListedSubscription(row.description, row.subscription_id) for row in rows))
+    )
+    state.search = None
+    state.page = None
+    if is_table_format():
+        return value_search_table(rows)
+    return render_records(value_search_records(rows))
+
+
+def load_value_mapping(path: Path) -> dict[UUID, str]:
+    """Return map from subscription_id to new value, read from a JSON object or a two column CSV file."""
+    with path.open(newline="") as file:
+        if path.suffix == ".json":
+            if not isinstance(mapping := json.load(file), dict):
+                raise ValueError(f"{path}: expected an object that maps subscription_id to value")
+            items = [list(item) for item in mapping.items()]
+        else:
+            items = [row for row in csv.reader(file) if row and row[0] != "subscription_id"]
+    try:
+        return {UUID(str(subscription_id)): str(value) for subscription_id, value in items}
+    except ValueError as value_error:
+        raise ValueError(f"{path}: expected subscription_id and value on every line ({value_error})") from value_error
+
+
+def subscription_filter(
+    regular_expression: str | None, product: str | None, subscription_ids: list[UUID] | None
+) -> list[ColumnElement[bool]]:
+    """Return where clauses that filter subscriptions on description, product name and/or subscription_id."""
+    where = []
+    if regular_expression is not None:
+        where.append(description_matches(regular_expression))
+    if product is not None:
+        where.append(SubscriptionTable.product.has(ProductTable.name == product))
+    if subscription_ids is not None:
+        where.append(SubscriptionTable.subscription_id.in_(subscription_ids))
+    return where
+
+
+def bulk_update_targets(resource_type: ResourceTypeTable, where: list[ColumnElement[bool]]) -> list[Row]:
+    """Return all product blocks with the resource type of the filtered subscriptions, with their value id if set."""
+    query = (
+        select(
+            SubscriptionInstanceTable.subscription_id,
+            SubscriptionInstanceTable.subscription_instance_id,
+            SubscriptionInstanceValueTable.subscription_instance_value_id,
+        )
+        .join(SubscriptionInstanceTable.subscription)
+        .join(SubscriptionInstanceTable.product_block)
+        .outerjoin(
+            SubscriptionInstanceValueTable,
+            and_(
+                SubscriptionInstanceValueTable.subscription_instance_id
+                == SubscriptionInstanceTable.subscription_instance_id,
+                SubscriptionInstanceValueTable.resource_type_id == resource_type.resource_type_id,
+            ),
+        )
+        .where(ProductBlockTable.resource_types.any(resource_type_id=resource_type.resource_type_id))
+        .where(*where)
+        .order_by(SubscriptionInstanceTable.subscription_id, SubscriptionInstanceTable.subscription_instance_id)
+    )
+    with invalid_regular_expression():
+        return list(db.session.execute(query).all())
+
+
+def write_values(
+    resource_type: ResourceTypeTable, targets: list[Row], new_value: str | None, mapping: dict[UUID, str] | None
+) -> None:
+    """Update the set values and insert the unset values of the targeted product blocks, with one statement each."""
+    updates = [target for target in targets if target.subscription_instance_value_id is not None]
+    inserts = [target for target in targets if target.subscription_instance_value_id is None]
+    if updates and mapping is None:
+        db.session.execute(
+            update(SubscriptionInstanceValueTable)
+            .where(
+                SubscriptionInstanceValueTable.subscription_instance_value_id.in_(
+                    [target.subscription_instance_value_id for target in updates]
+                )
+            )
+            .values(value=new_value)
+        )
+    elif updates and mapping is not None:
+        db.session.execute(
+            update(SubscriptionInstanceValueTable),
+            [
+                {
+                    "subscription_instance_value_id": target.subscription_instance_value_id,
+                    "value": mapping[target.subscription_id],
+                }
+                for target in updates
+            ],
+        )
+    if inserts:
+        db.session.execute(
+            insert(SubscriptionInstanceValueTable),
+            [
+                {
+                    "subscription_instance_id": target.subscription_instance_id,
+                    "resource_type_id": resource_type.resource_type_id,
+                    "value": new_value if mapping is None else mapping[target.subscription_id],
+                }
+                for target in inserts
+            ],
+        )
+
+
+def expire_written(targets: list[Row]) -> None:
+    """Expire the loaded values and value lists of the targeted product blocks, and nothing else in the session."""
+    expire_loaded(
+        SubscriptionInstanceValueTable,
+        [target.subscription_instance_value_id for target in targets if target.subscription_instance_value_id],
+        ["value"],
+    )
+    expire_loaded(
+        SubscriptionInstanceTable,
+        [target.subscription_instance_id for target in targets if target.subscription_instance_value_id is None],
+        ["values"],
+    )
+
+
+def resource_type_bulk_update(
+    resource_type_name: str,
+    regular_expression: str | None,
+    product: str | None,
+    new_value: str | None,
+    mapping: dict[UUID, str] | None,
+    dry_run: bool,
+    chunk_size: int,
+) -> Generator[str, None, None]:
+    """Implementation of the 'resource_type bulk_update' subcommand, yielding progress after every chunk."""
+    if edit_buffer.active:
+        raise ValueError("bulk updates are not staged, first commit or rollback the edit")
+    resource_type = db.session.scalars(
+        select(ResourceTypeTable).where(ResourceTypeTable.resource_type == resource_type_name)
+    ).one_or_none()
+    if resource_type is None:
+        raise ValueError(f"unknown resource type {resource_type_name}")
+    targets = bulk_update_targets(
+        resource_type, subscription_filter(regular_expression, product, list(mapping) if mapping is not None else None)
+    )
+    number_of_updates = sum(1 for target in targets if target.subscription_instance_value_id is not None)
+    number_of_inserts = len(targets) - number_of_updates
+    scope = f"resource type {resource_type_name} in {len({target.subscription_id for target in targets})} subscriptions"
+    if dry_run:
+        yield f"dry run: {number_of_updates} values to update and {number_of_inserts} values to insert for {scope}"
+        return
+    with state.writing():
+        for start in range(0, len(targets), chunk_size):
+            with transactional(db, logger):
+                write_values(resource_type, targets[start : start + chunk_size], new_value, mapping)
+            expire_written(targets[start : start + chunk_size])
+            yield f"{min(start + chunk_size, len(targets))}/{len(targets)} product blocks written"
+    yield f"{number_of_updates} values updated and {number_of_inserts} values inserted for {scope}"
@@ -0,0 +1,88 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import importlib.util
+import subprocess
+import sys
+from time import perf_counter
+from types import ModuleType
+
+from tabulate import tabulate
+
+START_TIME = perf_counter()
+
+# elapsed seconds since START_TIME at which each startup milestone was reached
+milestones: dict[str, float] = {}
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Import module that is only executed on first attribute access, its parent package is imported right away."""
+    if (module := sys.modules.get(name)) is not None:
+        return module
+    if (spec := importlib.util.find_spec(name)) is None or spec.loader is None:
+        raise ModuleNotFoundError(f"no module named {name}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def record_milestone(milestone: str) -> None:
+    """Record the time elapsed since startup at which milestone was reached."""
+    milestones[milestone] = perf_counter() - START_TIME
+
+
+def slowest_imports(statement: str, number_of_imports: int) -> list[tuple[str, float, float]]:
+    """Return slowest imports of statement in a fresh interpreter as (module, self, cumulative) seconds."""
+    stderr = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True, check=False
+    ).stderr
+    imports: dict[str, tuple[float, float]] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative_time, module = line.removeprefix("import time:").split("|")
+        # a module that is imported as part of a package import is listed twice, keep the largest times
+        imports[module.strip()] = max(
+            imports.get(module.strip(), (0.0, 0.0)), (int(self_time) / 1e6, int(cumulative_time) / 1e6)
+        )
+    return sorted(
+        ((module, self_time, cumulative_time) for module, (self_time, cumulative_time) in imports.items()),
+        key=lambda item: item[2],
+        reverse=True,
+    )[:number_of_imports]
+
+
+def startup_report(number_of_imports: int) -> str:
+    """Implementation of the 'startup' command."""
+    report = tabulate(
+        [(milestone, f"{elapsed:.3f} s") for milestone, elapsed in milestones.items()],
+        headers=["milestone", "elapsed"],
+        tablefmt="plain",
+    )
+    if number_of_imports > 0:
+        imports = slowest_imports("import orchestrator_shell", number_of_imports)
+        report += "\n\n" + tabulate(
+            [
+                (module, f"{self_time:.3f} s", f"{cumulative_time:.3f} s")
+                for module, self_time, cumulative_time in imports
+            ],
+            headers=["module", "self", "cumulative"],
+            tablefmt="plain",
+            disable_numparse=True,
+        )
+    return report
@@ -11,34 +11,192 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import re
+from collections.abc import Callable, Hashable, Iterator, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass, field
+from threading import Event
+from typing import Any, NamedTuple, TypeVar
+from uuid import UUID
 
-from orchestrator.db import SubscriptionInstanceTable, SubscriptionInstanceValueTable, SubscriptionTable
+from orchestrator.db import (
+    ProductBlockTable,
+    SubscriptionInstanceRelationTable,
+    SubscriptionInstanceTable,
+    SubscriptionInstanceValueTable,
+    SubscriptionTable,
+    db,
+)
+from sqlalchemy import ColumnElement, inspect, literal, select
+from sqlalchemy.exc import DataError
+from sqlalchemy.orm import joinedload, lazyload, selectinload
+from sqlalchemy.orm.strategy_options import _AbstractLoad
+from structlog import get_logger
 from tabulate import tabulate
 
+from orchestrator_shell.completion import PrefixIndex
+from orchestrator_shell.instrumentation import rendering
+from orchestrator_shell.output import Record, is_table_format, render_details, render_records
+from orchestrator_shell.settings import settings
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# a single worker, a prefetch of a previous selection is cancelled anyway
+prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+
+
+class ListedSubscription(NamedTuple):
+    """Subscription in a listing, without the memory overhead of an ORM object and its session bookkeeping."""
+
+    description: str
+    subscription_id: UUID
+
 
 @dataclass
 class State:
     """State that is shared between the WFO shell commands."""
 
-    subscriptions: list[SubscriptionTable] = field(default_factory=list)
-    filtered_subscriptions: list[SubscriptionTable] | None = None
-    subscription_index: int | None = None
+    subscriptions: Sequence[ListedSubscription] = field(default_factory=list)
+    search: str | None = None
+    page: int | None = None
+    subscription: SubscriptionTable | None = None
     product_block_index: int | None = None
     resource_type_index: int | None = None
+    subscription_positions: dict[UUID, int] = field(default_factory=dict, repr=False)
+    cache: dict[tuple[Hashable, ...], Any] = field(default_factory=dict, repr=False)
+    cache_hits: int = 0
+    cache_misses: int = 0
+    prefetch: Future[SubscriptionTable | None] | None = field(default=None, repr=False)
+    prefetch_cancelled: Event = field(default_factory=Event, repr=False)
+    all_listed: bool = False
+    subscription_names: PrefixIndex[UUID] | None = field(default=None, repr=False)
+
+    def list_subscriptions(self, subscriptions: Sequence[ListedSubscription], complete: bool = False) -> None:
+        """Set the listed subscriptions and rebuild the map from subscription_id to position in this list.
+
+        With complete, all subscriptions are listed, and the index of descriptions is rebuilt from this list when
+        next needed, which also picks up the subscriptions that were added since it was built.
+        """
+        self.subscriptions = subscriptions
+        self.subscription_positions = {
+            subscription.subscription_id: position for position, subscription in enumerate(subscriptions)
+        }
+        self.all_listed = complete
+        if complete:
+            self.subscription_names = None
+
+    def forget_descriptions(self) -> None:
+        """Forget the index of descriptions after descriptions changed, to rebuild it from the database when needed."""
+        self.all_listed = False
+        self.subscription_names = None
+
+    def cached(self, key: tuple[Hashable, ...], derive: Callable[[], T]) -> T:
+        """Return derived value cached under key, derive and cache it first on a cache miss."""
+        if key in self.cache:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            self.cache[key] = derive()
+        return self.cache[key]
+
+    def invalidate_cache(self) -> None:
+        """Forget all cached derived lists, to be called when the selected subscription or its values change."""
+        self.cache.clear()
+
+    def select_subscription(self, subscription_id: UUID) -> None:
+        """Select subscription, with prefetch enabled only its columns are loaded and the rest in the background."""
+        self.cancel_prefetch()
+        if not settings.ORCHESTRATOR_SHELL_PREFETCH:
+            self.subscription = load_subscription(subscription_id)
+            return
+        self.subscription = db.session.get(SubscriptionTable, subscription_id)
+        if self.subscription is not None and "instances" in inspect(self.subscription).unloaded:
+            self.prefetch_cancelled = Event()
+            self.prefetch = prefetch_executor.submit(prefetched_subscription, subscription_id, self.prefetch_cancelled)
+
+    def cancel_prefetch(self) -> None:
+        """Cancel the prefetch of the previously selected subscription, a running query is left to finish unused."""
+        if self.prefetch is not None:
+            self.prefetch_cancelled.set()
+            self.prefetch.cancel()
+            self.prefetch = None
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """Prepare the shell for writes to the database, and forget the cached lists afterwards.
+
+        A prefetch that is merged after the writes would overwrite the written values with the values it read
+        before, so it is cancelled first. Writes that are committed per chunk keep the chunks written so far when
+        they fail or are interrupted, so the cached lists are forgotten in that case as well.
+        """
+        self.cancel_prefetch()
+        try:
+            yield
+        finally:
+            self.invalidate_cache()
+
+    def adopt_prefetched(self) -> None:
+        """Wait for the prefetch of the selected subscription and merge it in the session of the shell.
+
+        To be called before the product blocks of the selected subscription are used or the subscription is changed,
+        on failure the product blocks are loaded on first use instead.
+        """
+        if (prefetch := self.prefetch) is None:
+            return
+        self.prefetch = None
+        try:
+            subscription = prefetch.result()
+        except Exception:
+            logger.warning("Prefetch of selected subscription failed", exc_info=True)
+            return
+        if subscription is not None:
+            db.session.merge(subscription, load=False)
 
     @property
     def selected_subscription(self) -> SubscriptionTable:
-        """Return the subscription indexed by subscription_index."""
-        if self.subscription_index is not None:
-            return self.subscriptions[self.subscription_index]
-        raise IndexError("subscription_index not set")
+        """Return the selected subscription."""
+        if self.subscription is not None:
+            return self.subscription
+        raise IndexError("subscription not set")
 
     @property
     def selected_product_blocks(self) -> list[SubscriptionInstanceTable]:
-        """Return sorted list of product blocks for the subscription indexed by subscription_index."""
-        return (
-            (sorted_product_blocks(self.selected_subscription.instances)) if self.subscription_index is not None else []
+        """Return (cached) sorted list of product blocks for the selected subscription."""
+        if (subscription := self.subscription) is None:
+            return []
+        self.adopt_prefetched()
+        return self.cached(
+            ("product blocks", subscription.subscription_id),
+            lambda: sorted_product_blocks(subscription.instances),
+        )
+
+    @property
+    def product_block_names(self) -> PrefixIndex[int]:
+        """Return (cached) index of the names of the selected product blocks to their position."""
+        if (subscription := self.subscription) is None:
+            return PrefixIndex()
+        return self.cached(
+            ("product block names", subscription.subscription_id),
+            lambda: PrefixIndex.build(
+                (product_block.product_block.name, position)
+                for position, product_block in enumerate(self.selected_product_blocks)
+            ),
+        )
+
+    @property
+    def product_block_positions(self) -> dict[UUID, int]:
+        """Return (cached) map from subscription_instance_id to position in the list of selected product blocks."""
+        if (subscription := self.subscription) is None:
+            return {}
+        return self.cached(
+            ("product block positions", subscription.subscription_id),
+            lambda: {
+                product_block.subscription_instance_id: position
+                for position, product_block in enumerate(self.selected_product_blocks)
+            },
         )
 
     @property
@@ -50,11 +208,25 @@ class State:
 
     @property
     def selected_resource_types(self) -> list[SubscriptionInstanceValueTable]:
-        """Return sorted list of resource types for the product block indexed by product_block_index."""
-        return (
-            sorted_resource_types(all_resource_types(self.selected_product_block))
-            if self.product_block_index is not None
-            else []
+        """Return (cached) sorted list of resource types for the product block indexed by product_block_index."""
+        if self.product_block_index is None:
+            return []
+        return self.cached(
+            ("resource types", self.selected_subscription.subscription_id, self.product_block_index),
+            lambda: sorted_resource_types(all_resource_types(self.selected_product_block)),
+        )
+
+    @property
+    def resource_type_names(self) -> PrefixIndex[int]:
+        """Return (cached) index of the names of the selected resource types to their position."""
+        if self.product_block_index is None:
+            return PrefixIndex()
+        return self.cached(
+            ("resource type names", self.selected_subscription.subscription_id, self.product_block_index),
+            lambda: PrefixIndex.build(
+                (resource_type.resource_type.resource_type, position)
+                for position, resource_type in enumerate(self.selected_resource_types)
+            ),
         )
 
     @property
@@ -65,57 +237,165 @@ class State:
         raise IndexError("resource_type_index not set")
 
     @property
-    def summary(self) -> str:
-        """List summary of the selected subscription, product block and resource type."""
+    def summary_records(self) -> list[Record]:
+        """Return records of the selected subscription, product block and resource type."""
         summary = []
-        if self.subscription_index is not None:
+        if self.subscription is not None:
             summary.append(
-                (
-                    "subscription",
-                    self.selected_subscription.description,
-                    self.selected_subscription.subscription_id,
-                )
+                {
+                    "selected": "subscription",
+                    "name": self.selected_subscription.description,
+                    "id": self.selected_subscription.subscription_id,
+                }
             )
         if self.product_block_index is not None:
             summary.append(
-                (
-                    "product block",
-                    self.selected_product_block.product_block.name,
-                    self.selected_product_block.subscription_instance_id,
-                ),
+                {
+                    "selected": "product block",
+                    "name": self.selected_product_block.product_block.name,
+                    "id": self.selected_product_block.subscription_instance_id,
+                }
             )
         if self.resource_type_index is not None:
             rt = self.selected_resource_type
             summary.append(
-                (
-                    "resource_type",
-                    rt.resource_type.resource_type,
-                    rt.subscription_instance_value_id if rt.value is not None else "<unset or non-scalar>",
-                ),
+                {
+                    "selected": "resource_type",
+                    "name": rt.resource_type.resource_type,
+                    "id": rt.subscription_instance_value_id if rt.value is not None else None,
+                }
             )
-        return tabulate(summary, tablefmt="plain")
+        return summary
 
     @property
-    def details(self) -> str:
-        """Show state details."""
+    @rendering
+    def summary(self) -> str:
+        """List summary of the selected subscription, product block and resource type."""
+        if not is_table_format():
+            return render_records(self.summary_records)
         return tabulate(
             [
-                ("number of subscriptions", len(self.subscriptions)),
                 (
-                    "number of filtered subscriptions",
-                    len(self.filtered_subscriptions) if self.filtered_subscriptions is not None else "0",
-                ),
-                ("subscription index", self.subscription_index if self.subscription_index is not None else "unset"),
-                ("product block index", self.product_block_index if self.subscription_index is not None else "unset"),
-                ("resource type index", self.resource_type_index if self.subscription_index is not None else "unset"),
-                ("currently selected", self.summary),
+                    record["selected"],
+                    record["name"],
+                    record["id"] if record["id"] is not None else "<unset or non-scalar>",
+                )
+                for record in self.summary_records
             ],
             tablefmt="plain",
         )
 
+    @property
+    def details(self) -> str:
+        """Show state details, unset values are shown as null when the output is formatted as JSON."""
+        unset, not_listed = ("unset", "not listed") if is_table_format() else (None, None)
+        return render_details(
+            {
+                "number of listed subscriptions": len(self.subscriptions),
+                "search": self.search if self.search is not None else unset,
+                "page": self.page if self.page is not None else unset,
+                "subscription id": self.subscription.subscription_id if self.subscription is not None else unset,
+                "subscription index": (
+                    self.subscription_positions.get(self.subscription.subscription_id, not_listed)
+                    if self.subscription is not None
+                    else unset
+                ),
+                "product block index": self.product_block_index if self.product_block_index is not None else unset,
+                "resource type index": self.resource_type_index if self.resource_type_index is not None else unset,
+                "currently selected": self.summary if is_table_format() else self.summary_records,
+                "cache hits": self.cache_hits,
+                "cache misses": self.cache_misses,
+            }
+        )
+
 
 state = State()
 
+RELATIONS = {
+    "depends_on": (SubscriptionInstanceTable.depends_on_block_relations, SubscriptionInstanceRelationTable.depends_on),
+    "in_use_by": (SubscriptionInstanceTable.in_use_by_block_relations, SubscriptionInstanceRelationTable.in_use_by),
+}
+
+
+def product_block_loader_options(depth: int, directions: tuple[str, ...] = tuple(RELATIONS)) -> list[_AbstractLoad]:
+    """Return loader options for product blocks, with related product blocks followed depth levels in directions."""
+    options = [
+        joinedload(SubscriptionInstanceTable.product_block).options(
+            selectinload(ProductBlockTable.resource_types),
+            lazyload(ProductBlockTable.in_use_by_block_relations),
+            lazyload(ProductBlockTable.depends_on_block_relations),
+        ),
+        selectinload(SubscriptionInstanceTable.values).joinedload(SubscriptionInstanceValueTable.resource_type),
+    ]
+    for direction, (relations, related_product_block) in RELATIONS.items():
+        loader = selectinload(relations)
+        if depth > 0 and direction in directions:
+            loader = loader.joinedload(related_product_block).options(
+                *product_block_loader_options(depth - 1, (direction,))
+            )
+        options.append(loader)
+    return options
+
+
+def load_subscription(subscription_id: UUID) -> SubscriptionTable:
+    """Return subscription loaded with product blocks, resource types and related product blocks in a few queries."""
+    subscription = db.session.identity_map.get(db.session.identity_key(SubscriptionTable, subscription_id))
+    if subscription is not None and "instances" not in inspect(subscription).unloaded:
+        return subscription
+    return db.session.execute(
+        select(SubscriptionTable)
+        .where(SubscriptionTable.subscription_id == subscription_id)
+        .options(
+            selectinload(SubscriptionTable.instances).options(
+                *product_block_loader_options(settings.ORCHESTRATOR_SHELL_PREFETCH_DEPTH)
+            )
+        )
+    ).scalar_one()
+
+
+def prefetched_subscription(subscription_id: UUID, cancelled: Event) -> SubscriptionTable | None:
+    """Return subscription loaded in a session of its own, detached from that session, or None when cancelled."""
+    if cancelled.is_set():
+        return None
+    with db.database_scope():
+        subscription = load_subscription(subscription_id)
+    return None if cancelled.is_set() else subscription
+
+
+def regular_expression_matches(column: ColumnElement[str], regular_expression: str) -> ColumnElement[bool]:
+    """Return case insensitive regular expression match on column, evaluated by the database.
+
+    PostgreSQL rejects an invalid regular expression with a DataError, other databases, like the SQLite file of the
+    benchmarks, fail with an unspecific error instead, so for them it is checked with the Python re module first.
+    """
+    if db.engine.dialect.name != "postgresql":
+        try:
+            re.compile(regular_expression)
+        except re.error as re_error:
+            raise ValueError(f"invalid regular expression: {re_error}") from re_error
+    return column.regexp_match(regular_expression, flags="i")
+
+
+def description_matches(regular_expression: str) -> ColumnElement[bool]:
+    """Return case insensitive regular expression match on subscription description, evaluated by the database."""
+    return regular_expression_matches(SubscriptionTable.description, regular_expression)
+
+
+@contextmanager
+def invalid_regular_expression() -> Iterator:
+    """Roll back the failed transaction and raise ValueError when the database rejects a regular expression."""
+    try:
+        yield
+    except DataError as data_error:
+        db.session.rollback()
+        raise ValueError(str(data_error.orig).strip()) from data_error
+
+
+def validate_regular_expression(regular_expression: str) -> None:
+    """Raise ValueError when the database rejects regular expression, before it is used outside the shell session."""
+    with invalid_regular_expression():
+        db.session.execute(select(regular_expression_matches(literal(""), regular_expression)))
+
 
 def all_resource_types(product_block: SubscriptionInstanceTable) -> list[SubscriptionInstanceValueTable]:
     """Add optional unset resource type(s) with value None to list of already set resource types."""
@@ -132,11 +412,6 @@ def all_resource_types(product_block: SubscriptionInstanceTable) -> list[Subscri
     )
 
 
-def sorted_subscriptions(subscriptions: list[SubscriptionTable]) -> list[SubscriptionTable]:
-    """Sort subscriptions on description."""
-    return sorted(subscriptions, key=lambda subscription: subscription.description)
-
-
 def sorted_product_blocks(product_blocks: list[SubscriptionInstanceTable]) -> list[SubscriptionInstanceTable]:
     """Sort product blocks on product block name."""
     return sorted(
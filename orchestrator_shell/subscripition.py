@@ -11,21 +11,49 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-import re
+from collections.abc import Generator, Iterable, Sequence
+from contextlib import closing
 from datetime import datetime
+from time import perf_counter
+from uuid import UUID
 
 from orchestrator.db import SubscriptionTable, db, transactional
+from sqlalchemy import Row, Select, any_, bindparam, func, select, update
+from sqlalchemy.dialects.postgresql import ARRAY
 from structlog import get_logger
 from tabulate import tabulate
 
-from orchestrator_shell.product_block import product_block_table
-from orchestrator_shell.state import sorted_subscriptions, state
+from orchestrator_shell.cache import subscription_cache
+from orchestrator_shell.completion import PrefixIndex
+from orchestrator_shell.database import expire_loaded
+from orchestrator_shell.edit import edit_buffer
+from orchestrator_shell.instrumentation import rendering
+from orchestrator_shell.output import Record, is_table_format, json_record, record_lines, render_details, render_records
+from orchestrator_shell.product_block import product_blocks_detail
+from orchestrator_shell.settings import settings
+from orchestrator_shell.state import (
+    ListedSubscription,
+    description_matches,
+    invalid_regular_expression,
+    state,
+)
 
 logger = get_logger(__name__)
 
+STREAM_BATCH_SIZE = 1000
 
-def indexed_subscription_list(subscriptions: list[SubscriptionTable]) -> str:
-    """Return tabulated indexed list of subscriptions."""
+
+def subscription_records(subscriptions: Iterable[ListedSubscription]) -> Generator[Record, None, None]:
+    """Yield indexed records of subscriptions."""
+    for index, subscription in enumerate(subscriptions):
+        yield {"index": index, "description": subscription.description, "subscription_id": subscription.subscription_id}
+
+
+@rendering
+def indexed_subscription_list(subscriptions: Sequence[ListedSubscription]) -> str:
+    """Return tabulated indexed list of subscriptions, or a list of records when the output is formatted as JSON."""
+    if not is_table_format():
+        return render_records(subscription_records(subscriptions))
     return tabulate(
         [(subscription.description, subscription.subscription_id) for subscription in subscriptions],
         tablefmt="plain",
@@ -34,64 +62,172 @@ def indexed_subscription_list(subscriptions: list[SubscriptionTable]) -> str:
     )
 
 
-def query_db() -> list[SubscriptionTable]:
-    """Return sorted and list of subscriptions from the database."""
-    return sorted_subscriptions(SubscriptionTable.query.all())
+def listed_subscriptions(regular_expression: str | None) -> Select:
+    """Return query for the listed subscription columns sorted on description, optionally filtered on description."""
+    query = select(SubscriptionTable.description, SubscriptionTable.subscription_id).order_by(
+        SubscriptionTable.description, SubscriptionTable.subscription_id
+    )
+    return query if regular_expression is None else query.where(description_matches(regular_expression))
+
+
+def query_db_filtered(
+    regular_expression: str | None, limit: int | None = None, offset: int = 0
+) -> list[ListedSubscription]:
+    """Return sorted list of optionally filtered subscriptions from the database, only fetching the listed columns.
+
+    When the cache is enabled, the subscriptions are listed from the local snapshot instead.
+    """
+    rows: Sequence[Row]
+    if settings.ORCHESTRATOR_SHELL_CACHE:
+        rows = subscription_cache.listed(regular_expression, limit=limit, offset=offset)
+    else:
+        with invalid_regular_expression():
+            rows = db.session.execute(listed_subscriptions(regular_expression).limit(limit).offset(offset)).all()
+    return list(map(ListedSubscription._make, rows))
+
+
+def stream_db() -> Generator[Row, None, None]:
+    """Yield sorted subscriptions from the database through a server side cursor, only fetching the listed columns."""
+    result = db.session.execute(listed_subscriptions(None).execution_options(yield_per=STREAM_BATCH_SIZE))
+    try:
+        yield from result
+    finally:
+        # also stops the query when the stream is interrupted
+        result.close()
 
 
-def filtered_subscriptions(regular_expression: str, subscriptions: list[SubscriptionTable]) -> list[SubscriptionTable]:
-    """Return filtered list of subscriptions."""
-    pattern = re.compile(regular_expression, flags=re.IGNORECASE)
-    return list(filter(lambda subscription: pattern.search(subscription.description), subscriptions))
+def query_db_count(regular_expression: str) -> int:
+    """Return number of subscriptions with description matching regular expression."""
+    if settings.ORCHESTRATOR_SHELL_CACHE:
+        return subscription_cache.count(regular_expression)
+    with invalid_regular_expression():
+        return db.session.scalar(select(func.count()).where(description_matches(regular_expression))) or 0
 
 
-def details_subscription_only(subscription: SubscriptionTable) -> list[tuple[str, str]]:
-    """Return list of tuples with subscription details only."""
-    return [
-        ("description", subscription.description),
-        ("subscription_id", subscription.subscription_id),
-        ("status", subscription.status),
-        ("product_id", subscription.product_id),
-        ("customer_id", subscription.customer_id),
-        ("insync", subscription.insync),
-        ("start_date", subscription.start_date),
-        ("end_date", subscription.end_date),
-        ("note", subscription.note),
-    ]
+def details_subscription_only(subscription: SubscriptionTable) -> Record:
+    """Return subscription details only."""
+    return {
+        "description": subscription.description,
+        "subscription_id": subscription.subscription_id,
+        "status": subscription.status,
+        "product_id": subscription.product_id,
+        "customer_id": subscription.customer_id,
+        "insync": subscription.insync,
+        "start_date": subscription.start_date,
+        "end_date": subscription.end_date,
+        "note": subscription.note,
+    }
 
 
-def details_product_blocks_only() -> list[tuple[str, str]]:
-    """Return list of tuples with product blocks details only."""
-    return [
-        ("product block(s)", product_block_table(state.selected_product_blocks)),
-    ]
+def details_product_blocks_only() -> Record:
+    """Return product blocks details only."""
+    return {"product block(s)": product_blocks_detail(state.selected_product_blocks)}
 
 
-def details_all(subscription: SubscriptionTable) -> list[tuple[str, str]]:
-    """Return list of tuples with all subscription details."""
-    return details_subscription_only(subscription) + details_product_blocks_only()
+def details_all(subscription: SubscriptionTable) -> Record:
+    """Return all subscription details."""
+    return details_subscription_only(subscription) | details_product_blocks_only()
 
 
 def subscription_list() -> str:
     """Add list of all subscriptions to the state and return this list tabulated and indexed."""
-    state.subscriptions = query_db()
-    state.filtered_subscriptions = None
+    state.search = None
+    if settings.ORCHESTRATOR_SHELL_PAGE_SIZE:
+        return subscription_page(0)
+    state.list_subscriptions(query_db_filtered(None), complete=True)
+    state.page = None
     return indexed_subscription_list(state.subscriptions)
 
 
-def subscription_search(regular_expression: str) -> str:
+def collected(
+    rows: Iterable[Row], subscriptions: list[ListedSubscription]
+) -> Generator[ListedSubscription, None, None]:
+    """Yield rows as listed subscriptions while appending them to the list of subscriptions."""
+    for row in rows:
+        subscription = ListedSubscription._make(row)
+        subscriptions.append(subscription)
+        yield subscription
+
+
+def subscription_list_stream() -> Generator[str, None, None]:
+    """Add list of all subscriptions to the state while yielding this list tabulated and indexed line by line."""
+    state.search = None
+    state.page = None
+    subscriptions: list[ListedSubscription] = []
+    complete = False
+    try:
+        if not is_table_format():
+            with closing(stream_db()) as rows:
+                yield from record_lines(subscription_records(collected(rows, subscriptions)))
+            complete = True
+            return
+        number_of_subscriptions, width = db.session.execute(
+            select(func.count(), func.coalesce(func.max(func.length(SubscriptionTable.description)), 0))
+        ).one()
+        index_width = len(str(number_of_subscriptions - 1))
+        with closing(stream_db()) as rows:
+            for index, subscription in enumerate(collected(rows, subscriptions)):
+                yield f"{index:<{index_width}}  {subscription.description:<{width}}  {subscription.subscription_id}"
+        complete = True
+    finally:
+        state.list_subscriptions(subscriptions, complete=complete)
+
+
+def subscription_page(page: int) -> str:
+    """Add page of (searched) subscriptions to the state and return it tabulated and indexed, or empty if none."""
+    page_size = settings.ORCHESTRATOR_SHELL_PAGE_SIZE
+    if not (subscriptions := query_db_filtered(state.search, limit=page_size, offset=page * page_size)):
+        return ""
+    state.list_subscriptions(subscriptions)
+    state.page = page
+    return indexed_subscription_list(state.subscriptions)
+
+
+def subscription_search(regular_expression: str, limit: int | None) -> str:
     """Add list of filtered subscriptions to the state and return this list tabulated and indexed."""
-    state.subscriptions = query_db()
-    state.filtered_subscriptions = filtered_subscriptions(regular_expression, state.subscriptions)
-    return indexed_subscription_list(state.filtered_subscriptions)
+    if page_size := settings.ORCHESTRATOR_SHELL_PAGE_SIZE:
+        state.list_subscriptions(query_db_filtered(regular_expression, limit=page_size))
+        state.page = 0
+    else:
+        state.list_subscriptions(query_db_filtered(regular_expression, limit=limit))
+        state.page = None
+    state.search = regular_expression
+    return indexed_subscription_list(state.subscriptions)
+
+
+def subscription_search_count(regular_expression: str) -> str:
+    """Implementation of the 'subscription search --count' subcommand."""
+    if is_table_format():
+        return str(query_db_count(regular_expression))
+    return json_record({"count": query_db_count(regular_expression)})
+
+
+def subscription_names() -> PrefixIndex[UUID]:
+    """Return (cached) index of the descriptions of all subscriptions to their subscription_id.
+
+    Built from the listed subscriptions when all are listed, otherwise from a single query.
+    """
+    if state.subscription_names is None:
+        state.subscription_names = PrefixIndex.build(
+            state.subscriptions if state.all_listed else query_db_filtered(None)
+        )
+    return state.subscription_names
 
 
 def subscription_select(index: int) -> str:
     """Implementation of the 'subscription select' subcommand."""
-    if state.filtered_subscriptions is None:
-        state.subscription_index = index
-    else:
-        state.subscription_index = state.subscriptions.index(state.filtered_subscriptions[index])
+    return subscription_select_id(state.subscriptions[index].subscription_id)
+
+
+def subscription_select_description(description: str) -> str:
+    """Implementation of the 'subscription select' subcommand with a description instead of an index."""
+    return subscription_select_id(subscription_names().unique(description, "subscription"))
+
+
+def subscription_select_id(subscription_id: UUID) -> str:
+    """Select subscription and return summary of the selection."""
+    state.select_subscription(subscription_id)
+    state.invalidate_cache()
     state.product_block_index = None
     state.resource_type_index = None
     return state.summary
@@ -100,14 +236,78 @@ def subscription_select(index: int) -> str:
 def subscription_details(subscription_only: bool, product_blocks_only: bool) -> str:
     """Implementation of the 'subscription details' subcommand."""
     if subscription_only:
-        return tabulate(details_subscription_only(state.selected_subscription), tablefmt="plain")
+        return render_details(details_subscription_only(state.selected_subscription))
     elif product_blocks_only:  # noqa: RET505
-        return tabulate(details_product_blocks_only(), tablefmt="plain")
+        return render_details(details_product_blocks_only())
     else:
-        return tabulate(details_all(state.selected_subscription), tablefmt="plain")
+        return render_details(details_all(state.selected_subscription))
+
+
+def parse_field_value(field: str, new_value: str) -> str | bool | datetime | None:
+    """Return new value for subscription field converted to the type of that field, raise ValueError when invalid."""
+    if field in ["insync"]:
+        if new_value.lower() in ["y", "yes", "true"]:
+            return True
+        if new_value.lower() in ["n", "no", "false"]:
+            return False
+        raise ValueError("expected y, yes, true, n, no or false")
+    if field in ["start_date", "end_date"]:
+        if new_value == "":
+            return None
+        timestamp = datetime.fromisoformat(new_value)
+        return timestamp.astimezone() if timestamp.tzinfo is None else timestamp
+    return new_value
 
 
 def subscription_update(field: str, new_value: str | bool | datetime | None) -> None:
-    """Implementation of the 'subscription update' subcommand."""
-    with transactional(db, logger):
+    """Implementation of the 'subscription update' subcommand, only staged while editing."""
+    if edit_buffer.active:
+        edit_buffer.stage_field(state.selected_subscription, field, new_value)
+        return
+    with state.writing(), transactional(db, logger):
         setattr(state.selected_subscription, field, new_value)
+    subscription_cache.invalidate([state.selected_subscription.subscription_id])
+    if field == "description":
+        state.forget_descriptions()
+
+
+def subscription_update_filtered(
+    field: str, new_value: str | bool | datetime | None, chunk_size: int
+) -> Generator[str, None, None]:
+    """Implementation of the 'subscription update --all-filtered' subcommand, yielding progress after every chunk."""
+    if edit_buffer.active:
+        raise ValueError("updates of all filtered subscriptions are not staged, first commit or rollback the edit")
+    start_time = perf_counter()
+    with invalid_regular_expression():
+        subscription_ids = list(
+            db.session.scalars(select(SubscriptionTable.subscription_id).where(description_matches(state.search or "")))
+        )
+    ids = bindparam("ids", type_=ARRAY(SubscriptionTable.subscription_id.type))
+    statement = (
+        update(SubscriptionTable)
+        .where(SubscriptionTable.subscription_id == any_(ids))
+        .values({field: new_value})
+        .execution_options(synchronize_session=False)
+    )
+    number_of_updates = 0
+    if field == "description":
+        state.forget_descriptions()
+    with state.writing():
+        for start in range(0, len(subscription_ids), chunk_size):
+            with transactional(db, logger):
+                result = db.session.execute(statement, {"ids": subscription_ids[start : start + chunk_size]})
+            number_of_updates += result.rowcount
+            # only the updated field of the loaded subscriptions is stale, everything else in the session is valid
+            expire_loaded(SubscriptionTable, subscription_ids[start : start + chunk_size], [field])
+            subscription_cache.invalidate(subscription_ids[start : start + chunk_size])
+            yield f"{number_of_updates}/{len(subscription_ids)} subscriptions updated"
+    yield f"updated {field} of {number_of_updates} subscriptions in {perf_counter() - start_time:.2f} seconds"
+
+
+def subscription_cache_status(refresh: bool, full: bool) -> str:
+    """Implementation of the 'subscription cache' subcommand."""
+    if refresh or full:
+        start_time = perf_counter()
+        changed, deleted = subscription_cache.refresh(full=full)
+        return f"fetched {changed} and removed {deleted} subscriptions in {perf_counter() - start_time:.2f} seconds"
+    return render_details(dict(subscription_cache.status()))
@@ -0,0 +1,44 @@
+#  Copyright 2024 SURF.
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections.abc import Iterable
+from io import StringIO
+
+import pytest
+
+import orchestrator_shell
+from orchestrator_shell.batch import batch_argument_parser, batch_commands
+from orchestrator_shell.main import OrchestratorShell
+
+
+def test_batch_commands_run_arguments_first() -> None:
+    """Arguments are run before the commands given with -c, empty ones are skipped."""
+    args, cli_args = batch_argument_parser().parse_known_args(["-c", "product_block list", "subscription list", ""])
+    assert list(batch_commands(args, cli_args, StringIO())) == ["subscription list", "product_block list"]
+
+
+def test_arguments_run_with_stdin_not_a_tty(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Arguments are run in batch mode with stdin not a tty: orchestrator-shell "subscription list" </dev/null."""
+    ran: list[str] = []
+
+    def run_batch(self: OrchestratorShell, commands: Iterable[str], keep_going: bool, status: bool) -> int:  # noqa: ARG001
+        ran.extend(commands)
+        return 0
+
+    monkeypatch.setattr(OrchestratorShell, "run_batch", run_batch)
+    monkeypatch.setattr("sys.argv", ["orchestrator-shell", "subscription list", "quit"])
+    monkeypatch.setattr("sys.stdin", StringIO())
+    with pytest.raises(SystemExit) as exit_info:
+        orchestrator_shell.main()
+    assert exit_info.value.code == 0
+    assert ran == ["subscription list", "quit"]